@@ -0,0 +1,5 @@
+"""
+Benchmarks and stress tests of opensubtitles.api (they are not part of the plugin), run from the repository root:
+
+    python -m benchmarks.<module>
+"""
@@ -0,0 +1,84 @@
+"""
+Size and decode time benchmark of the cached entries (their compression, and the compact encoding of the
+responses), over the fixtures in corpus/:
+a subtitles file (subtitles.srt) and a 500 rows SearchSubtitles response with the fields of a real response
+(search-response.json). Both are synthetic: the subtitles text is generated, and so are the response values.
+
+    python -m benchmarks.cachebench
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Callable, List, Optional
+
+import tabulate
+
+from benchmarks.timing import best_time
+from opensubtitles.api.cache import (COMPRESSION_CODECS, compress_entry, decode_compact_response, decompress_entry,
+                                     DEFAULT_COMPRESSION, encode_compact_response, project_response, zstandard)
+
+CORPUS_DIR = os.path.join(os.path.dirname(__file__), "corpus")
+SUBTITLES_PATH = os.path.join(CORPUS_DIR, "subtitles.srt")
+RESPONSE_PATH = os.path.join(CORPUS_DIR, "search-response.json")
+
+
+def available_codecs() -> List[Optional[str]]:
+    return [None] + [codec for codec in COMPRESSION_CODECS if codec != 'zstd' or zstandard is not None]
+
+
+def compression_rows(label: str, content: bytes, decode: Callable[[bytes], object], repeats: int, number: int):
+    """ :return: the stored size, the encoding time and the decoding time (to a value) of each codec """
+    rows = []
+    for codec in available_codecs():
+        stored = compress_entry(content, codec)
+        encode_time = best_time(lambda: compress_entry(content, codec), repeats, number)
+        decode_time = best_time(lambda: decode(decompress_entry(stored)), repeats, number)
+        rows.append([label, codec or "none", len(content) / 1024, len(stored) / 1024, encode_time * 1e3,
+                     decode_time * 1e3])
+    return rows
+
+
+def response_rows(response: dict, repeats: int, number: int):
+    """ :return: the size and the decoding time of each encoding of the response (as stored with the default codec) """
+    encodings = {
+        'full JSON': (lambda r: json.dumps(r).encode('utf8'), json.loads),
+        'compact, all fields': (encode_compact_response, decode_compact_response),
+        'compact': (lambda r: encode_compact_response(project_response(r)), decode_compact_response),
+    }
+    rows = []
+    for label, (encode, decode) in encodings.items():
+        content = encode(response)
+        stored = compress_entry(content, DEFAULT_COMPRESSION)
+        decode_time = best_time(lambda: decode(decompress_entry(stored)), repeats, number)
+        rows.append([label, len(content) / 1024, len(stored) / 1024, decode_time * 1e3])
+    return rows
+
+
+def main():
+    p = argparse.ArgumentParser(description="Cached entries size and decode time benchmark")
+    p.add_argument("-r", "--repeats", type=int, default=5, help="The time is the best of the repeats")
+    p.add_argument("-n", "--number", type=int, default=10, help="The number of calls per repeat")
+    args = p.parse_args()
+
+    with open(SUBTITLES_PATH, "rb") as f:
+        subtitles = f.read()
+    with open(RESPONSE_PATH, "rb") as f:
+        response = json.loads(f.read())
+
+    rows = compression_rows("subtitles", subtitles, bytes, args.repeats, args.number)
+    rows += compression_rows("response", json.dumps(response).encode('utf8'), json.loads, args.repeats, args.number)
+    print(tabulate.tabulate(rows, floatfmt=".2f", headers=(
+        "entry", "compression", "raw KB", "stored KB", "encode ms", "decode ms")))
+    print()
+
+    if decode_compact_response(encode_compact_response(project_response(response))) != project_response(response):
+        print("The compact response does not decode to the projected response")
+        sys.exit(1)
+    rows = response_rows(response, args.repeats, args.number)
+    print(tabulate.tabulate(rows, floatfmt=".2f", headers=(
+        f"response ({len(response['data'])} rows)", "raw KB", f"stored KB ({DEFAULT_COMPRESSION})", "decode ms")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of the movie hash: the block sum (per-word, struct and NumPy), and hashing files (from the page cache).
+
+    python -m benchmarks.hashbench
+"""
+import argparse
+import os
+import struct
+import sys
+import tempfile
+from typing import List
+
+import tabulate
+
+from benchmarks.timing import best_time
+from opensubtitles.api import hash as movie_hash
+from opensubtitles.api.hash import block_mask, block_size, hash_file, hash_files, min_file_size, sum_block
+
+
+def sum_words(buf: bytes) -> int:
+    """ The per-word implementation of sum_block() """
+    total = 0
+    for (word,) in struct.iter_unpack('<q', buf):
+        total = (total + word) & block_mask
+    return total
+
+
+def write_files(dir_path: str, count: int, file_size: int) -> List[str]:
+    paths = []
+    for i in range(count):
+        path = os.path.join(dir_path, f"movie-{i}.mkv")
+        with open(path, "wb") as f:
+            f.write(os.urandom(file_size))
+        paths.append(path)
+    return paths
+
+
+def main():
+    p = argparse.ArgumentParser(description="Movie hash micro-benchmark")
+    p.add_argument("-r", "--repeats", type=int, default=5, help="The time is the best of the repeats")
+    p.add_argument("-n", "--number", type=int, default=20, help="The number of calls per repeat")
+    p.add_argument("--files", type=int, default=64, help="The number of files hashed by hash_files()")
+    p.add_argument("--file-size", type=int, default=min_file_size + 4093, help="The size of each hashed file")
+    args = p.parse_args()
+
+    buf = os.urandom(block_size)
+    numpy = movie_hash.numpy
+    rows = [['per-word', best_time(lambda: sum_words(buf), args.repeats, args.number) * 1e3]]
+    movie_hash.numpy = None
+    try:
+        struct_sum = sum_block(buf)
+        rows.append(['struct', best_time(lambda: sum_block(buf), args.repeats, args.number) * 1e3])
+    finally:
+        movie_hash.numpy = numpy
+    if numpy is not None:
+        rows.append(['numpy', best_time(lambda: sum_block(buf), args.repeats, args.number) * 1e3])
+    if not sum_words(buf) == struct_sum == sum_block(buf):
+        print("sum_block() does not match the per-word sum")
+        sys.exit(1)
+    print(tabulate.tabulate(rows, headers=("block sum", "ms/block"), floatfmt=".4f"))
+    print()
+
+    with tempfile.TemporaryDirectory(prefix="opensubtitles-hashbench-") as dir_path:
+        paths = write_files(dir_path, args.files, args.file_size)
+        single = best_time(lambda: hash_file(paths[0]), args.repeats, args.number)
+        rows = [['hash_file', single * 1e3, 1 / single]]
+        for workers in [1, movie_hash.default_hash_workers]:
+            elapsed = best_time(lambda: list(hash_files(paths, workers)), args.repeats, 1)
+            rows.append([f'hash_files ({workers} workers)', elapsed / len(paths) * 1e3, len(paths) / elapsed])
+        print(tabulate.tabulate(rows, headers=("hashing", "ms/file", "files/s"), floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Accuracy and throughput regression benchmark of the file name parser, over the corpus of release names
+in corpus/filenames.jsonl (each name with its expected parse_filename() output).
+
+    python -m benchmarks.parserbench           # fails on any accuracy regression
+    python -m benchmarks.parserbench --update  # regenerates the corpus, after an intended output change
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tracemalloc
+from typing import Callable, Iterable, List, Mapping, Tuple
+
+import tabulate
+
+from benchmarks.timing import best_time
+from opensubtitles.api.filenameparser import (AUDIO_LABELS, parse_filename, parse_filename_regex,
+                                              parse_filename_tokens, parse_filenames, PARSER_VERSION,
+                                              QUALITY_OPTIONS, RELEASE_FORMATS, TV_TERMS, VIDEO_CONTAINERS,
+                                              VIDEO_LABELS)
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "corpus", "filenames.jsonl")
+CORPUS_SIZE = 3000
+CORPUS_SEED = 0
+
+TITLES = [
+    "The Matrix", "Breaking Bad", "Dune Part Two", "Spirited Away", "Game of Thrones", "Mr. Robot", "Amélie",
+    "The Office", "Blade Runner 2049", "Better Call Saul", "Oppenheimer", "Twin Peaks", "Alien", "Succession",
+    "The Lord of the Rings The Two Towers", "Everything Everywhere All at Once", "Severance", "Heat",
+    "No Country for Old Men", "Parasite", "Stranger Things", "The Last of Us", "Arrival", "Fargo",
+]
+ANIME_TITLES = [
+    "Shingeki no Kyojin", "Frieren", "Kimetsu no Yaiba", "Jujutsu Kaisen", "K-On", "Sousou no Frieren",
+    "Spy x Family", "Chainsaw Man", "Mob Psycho 100", "Cowboy Bebop", "Bocchi the Rock", "Oshi no Ko",
+]
+GROUPS = ["RARBG", "YTS", "FGT", "NTb", "SPARKS", "FLUX", "GalaxyRG", "EVO", "playWEB", "ION10", "CAKES", "SubsPlease"]
+AUDIO_QUALITIES = ["5.1", "7.1", "2.0", "6CH"]
+EPISODE_TITLES = ["Pilot", "The Long Night", "Ozymandias", "Chapter One", "Finale"]
+
+
+def release_term(r: random.Random, term: str) -> str:
+    """ :return: the term as written in release names (its "-" is an optional separator, e.g., "x264", "H.264") """
+    return term.replace("-", r.choice(["", "", ".", "-"]))
+
+
+def generate_movie_name(r: random.Random) -> str:
+    sep = r.choice(".. -_")
+    parts = r.choice(TITLES).split()
+    if r.random() < .8:
+        parts.append(str(r.randint(1950, 2024)))
+    if r.random() < .8:
+        parts.append(r.choice(QUALITY_OPTIONS))
+    if r.random() < .8:
+        parts.append(release_term(r, r.choice(RELEASE_FORMATS)))
+    parts += [release_term(r, label) for label in r.sample(VIDEO_LABELS, r.randint(0, 2))]
+    if r.random() < .5:
+        label = release_term(r, r.choice(AUDIO_LABELS))
+        if r.random() < .6:
+            label += r.choice(["", ".", " "]) + r.choice(AUDIO_QUALITIES)
+        parts.append(label)
+    name = sep.join(parts)
+    if r.random() < .7:
+        name += "-" + r.choice(GROUPS)
+    return name
+
+
+def generate_episode_name(r: random.Random) -> str:
+    sep = r.choice("..- ")
+    parts = r.choice(TITLES).split()
+    if r.random() < .2:
+        parts.append(str(r.randint(2000, 2024)))
+    episode = f"S{r.randint(1, 12):02d}E{r.randint(1, 24):02d}" if r.random() < .85 else f"S{r.randint(1, 12):02d}"
+    parts.append(episode if r.random() < .8 else episode.lower())
+    if r.random() < .3:
+        parts += r.choice(EPISODE_TITLES).split()
+    if r.random() < .8:
+        parts.append(r.choice(QUALITY_OPTIONS))
+    if r.random() < .6:
+        parts.append(r.choice(TV_TERMS))
+    parts.append(r.choice(["WEB-DL", "WEBRip", "HDTV", "WEB", "BluRay"]))
+    if r.random() < .6:
+        parts.append(r.choice(["DDP5.1", "AAC2.0", "DD5.1", "Atmos", "DTS-HD.MA.5.1"]))
+    if r.random() < .7:
+        parts.append(r.choice(["H.264", "H.265", "x264", "x265", "HEVC", "10bit"]))
+    return sep.join(parts) + "-" + r.choice(GROUPS)
+
+
+def generate_anime_name(r: random.Random) -> str:
+    title = r.choice(ANIME_TITLES)
+    if r.random() < .5:
+        # Fansub style
+        return f"[{r.choice(GROUPS)}] {title} - {r.randint(1, 26):02d} ({r.choice(QUALITY_OPTIONS)})"
+    # Broadcaster tags (e.g., "CR", "B-Global", "AT-X")
+    parts = title.split() + [f"S{r.randint(1, 4):02d}E{r.randint(1, 26):02d}", r.choice(QUALITY_OPTIONS),
+                             r.choice(TV_TERMS[TV_TERMS.index("ADN"):]), r.choice(["WEB-DL", "WEBRip", "HDTV"])]
+    parts += r.sample(["AAC2.0", "DDP2.0", "Atmos", "H.264", "x265", "10bit", "MultiAudio"], r.randint(0, 3))
+    return ".".join(parts) + "-" + r.choice(GROUPS)
+
+
+def generate_names(n: int = CORPUS_SIZE, seed: int = CORPUS_SEED) -> List[str]:
+    """ :return: deterministic release names of movies, episodes and anime, with various labels and extensions """
+    r = random.Random(seed)
+    generators = [generate_movie_name] * 4 + [generate_episode_name] * 4 + [generate_anime_name] * 2
+    names = set()
+    while len(names) < n:
+        name = r.choice(generators)(r)
+        if r.random() < .9:
+            name += "." + r.choice(VIDEO_CONTAINERS + ["mkv", "mp4", "srt", "sub", "MKV"])
+        names.add(name)
+    return sorted(names)
+
+
+def normalize_properties(properties: Mapping) -> dict:
+    """ :return: the properties with sorted lists (the order of the multiple values is arbitrary) """
+    return {k: sorted(v) if isinstance(v, (list, tuple)) else v for k, v in sorted(properties.items())}
+
+
+def write_corpus(names: Iterable[str], corpus_path: str = CORPUS_PATH):
+    """ The expected output is the reference (regexps) parser output """
+    os.makedirs(os.path.dirname(corpus_path), exist_ok=True)
+    with open(corpus_path, "w", encoding="utf8") as f:
+        for name in names:
+            entry = {'name': name, 'expected': normalize_properties(parse_filename_regex(name))}
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+
+def read_corpus(corpus_path: str = CORPUS_PATH) -> List[Tuple[str, dict]]:
+    with open(corpus_path, encoding="utf8") as f:
+        return [(entry['name'], entry['expected']) for entry in map(json.loads, f)]
+
+
+def check_accuracy(corpus: List[Tuple[str, dict]]) -> List[Tuple[str, dict, dict]]:
+    """ :return: the (name, expected, actual) of each name that is not parsed as expected (single and batch) """
+    errors = []
+    columns = parse_filenames(name for name, _ in corpus)
+    for i, (name, expected) in enumerate(corpus):
+        actual = normalize_properties(parse_filename(name))
+        batch = normalize_properties({k: column[i] for k, column in columns.items() if column[i] is not None})
+        if actual != expected or batch != expected:
+            errors.append((name, expected, actual if actual != expected else batch))
+    return errors
+
+
+def measure(parse: Callable[[List[str]], object], names: List[str], repeats: int) -> Tuple[float, int]:
+    """ :return: names per second (the best of the repeats), and the peak traced memory of a single run """
+    best = best_time(lambda: parse(names), repeats)
+
+    tracemalloc.start()
+    try:
+        parse(names)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return len(names) / best, peak
+
+
+def main():
+    p = argparse.ArgumentParser(description="File name parser accuracy and throughput benchmark")
+    p.add_argument("--corpus", default=CORPUS_PATH)
+    p.add_argument("-r", "--repeats", type=int, default=5, help="The throughput is the best of the repeats")
+    p.add_argument("--reference", action="store_true", help="Also measure the reference (regexps) parser")
+    p.add_argument("--update", action="store_true", help="Regenerate the corpus and its expected output")
+    args = p.parse_args()
+
+    if args.update:
+        write_corpus(generate_names(), args.corpus)
+
+    corpus = read_corpus(args.corpus)
+    errors = check_accuracy(corpus)
+    for name, expected, actual in errors[:10]:
+        print(f"{name!r}\n  expected: {expected}\n  actual:   {actual}")
+
+    names = [name for name, _ in corpus]
+    parsers = {
+        'parse_filename_tokens': lambda batch: [parse_filename_tokens(name) for name in batch],
+        'parse_filenames': parse_filenames,
+    }
+    if args.reference:
+        parsers['parse_filename_regex'] = lambda batch: [parse_filename_regex(name) for name in batch]
+    rows = [[label, *measure(parse, names, args.repeats)] for label, parse in parsers.items()]
+    print(tabulate.tabulate(rows, headers=("parser", "names/s", "peak bytes"), floatfmt=".0f"))
+    print(f"parser version {PARSER_VERSION}: {len(corpus) - len(errors)}/{len(corpus)} names parsed as expected")
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
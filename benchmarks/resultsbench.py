@@ -0,0 +1,182 @@
+"""
+Benchmark of ranking the search results, and of the memory they hold, over the 500 rows SearchSubtitles response
+in corpus/search-response.json, for several movie files and query languages. The file name parser cache is warm
+(as for repeated searches).
+
+    python -m benchmarks.resultsbench
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from collections import defaultdict
+from typing import Callable, List, Mapping, Optional, Tuple
+
+import tabulate
+
+from benchmarks.timing import best_time
+from opensubtitles.api.cache import decode_compact_response, encode_compact_response, project_response
+from opensubtitles.api.filenameparser import parse_filename
+from opensubtitles.api.results import Query, SUPPORTED_SUBTITLES_EXT
+
+RESPONSE_PATH = os.path.join(os.path.dirname(__file__), "corpus", "search-response.json")
+
+MOVIES = [
+    "/movies/The.Matrix.1999.720p.WEB-DL.AMZN.DDP5.1-FLUX.mkv",
+    "/movies/The.Matrix.1999.1080p.BluRay.x264-GRP.mkv",
+    "/movies/The Matrix (1999)/the.matrix.1999.2160p.uhd.bluray.x265-swtyblz.mkv",
+    "/movies/The.Matrix.1999.REMASTERED.1080p.BluRay.x264.DTS-HD.MA.5.1-FGT.mkv",
+    "/movies/The Matrix.avi",
+]
+LANGUAGES = [["eng"], ["heb", "eng"], ["fre", "ger", "spa"], ["pob", "eng", "heb", "ger"]]
+
+Case = Tuple[Optional[str], List[str]]
+
+
+def read_response(response_path: str = RESPONSE_PATH) -> dict:
+    with open(response_path, encoding="utf8") as f:
+        return json.load(f)
+
+
+def new_query(case: Case) -> Query:
+    movie, languages = case
+    return Query(None, languages, movie_file_path=movie, query="the matrix")
+
+
+def reference_score(query: Query, row: dict) -> float:
+    """ :return: the score of the row, as computed by Subtitles.score before the precomputed scoring """
+    if row['SubFormat'] not in SUPPORTED_SUBTITLES_EXT:
+        return -1
+
+    properties = parse_filename(row['SubFileName'])
+    for k in ("title", "season-episode"):
+        if properties.get(k, None) != query.properties.get(k, None):
+            return -1
+
+    score = float(row['SubRating'])
+
+    def get_property(p: Mapping, key: str) -> set:
+        return set([v.replace("-. ", "").lower() for v in p.get(key, [])])
+
+    def match_properties(key: str):
+        return len(get_property(properties, key).intersection(get_property(query.properties, key)))
+
+    score += 10 * match_properties("release-format")
+    score += 10 * match_properties("group")
+    score += 100 * match_properties("tv-term")
+    return score
+
+
+def reference_ranking(query: Query, data: List[dict]) -> List[int]:
+    """ :return: the ranking of all the rows at once (ordered by the language, and then by the descending score) """
+    lang_order = defaultdict(lambda: float('inf'), **{l: i for i, l in enumerate(query.languages)})
+    scores = [reference_score(query, r) for r in data]
+    return sorted((i for i, score in enumerate(scores) if score >= 0),
+                  key=lambda i: (lang_order[data[i]['SubLanguageID']], -scores[i]))
+
+
+def check_rankings(cases: List[Case], response: dict) -> List[Case]:
+    """ :return: the cases whose ranked results (accessed in various ways) differ from the reference ranking """
+    errors = []
+    data = response['data']
+    for case in cases:
+        expected = reference_ranking(new_query(case), data)
+        first, top, full = new_query(case), new_query(case), new_query(case)
+        for q in first, top, full:
+            q.set_response(response)
+        rankings = [
+            [r.data for r in full],
+            ([first[0].data] if expected else []) + [r.data for r in first][1:],
+            [r.data for r in top[:20] or []] + [r.data for r in top[20:] or []],
+            [data[i] for i in full.ranking],
+        ]
+        if any([id(r) for r in ranking] != [id(data[i]) for i in expected] for ranking in rankings):
+            errors.append(case)
+    return errors
+
+
+def measure(access: Callable[[Query, dict], object], cases: List[Case], response: dict, repeats: int) -> float:
+    """ :return: the time of a single response in seconds (the best of the repeats) """
+    queries = []
+
+    def new_queries():
+        queries[:] = [new_query(case) for case in cases]
+
+    def access_all():
+        for q in queries:
+            access(q, response)
+
+    return best_time(access_all, repeats, setup=new_queries) / len(cases)
+
+
+def measure_memory(cases: List[Case], response: dict) -> Tuple[float, float]:
+    """
+    Each query gets its own response, decoded from the cache (compact) format.
+    :return: the traced bytes per response row (the decoded response and its query),
+             and per result (the Subtitles of the ranked rows, once iterated)
+    """
+    encoded = encode_compact_response(project_response(response))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        queries = []
+        for case in cases:
+            q = new_query(case)
+            q.set_response(decode_compact_response(encoded))
+            queries.append(q)
+        gc.collect()
+        responses_size = tracemalloc.get_traced_memory()[0]
+        results = sum(len(list(q)) for q in queries)
+        gc.collect()
+        results_size = tracemalloc.get_traced_memory()[0] - responses_size
+    finally:
+        tracemalloc.stop()
+    return responses_size / (len(cases) * len(response['data'])), results_size / results
+
+
+def main():
+    p = argparse.ArgumentParser(description="Search results ranking benchmark")
+    p.add_argument("--response", default=RESPONSE_PATH)
+    p.add_argument("-r", "--repeats", type=int, default=10, help="The time is the best of the repeats")
+    args = p.parse_args()
+
+    response = read_response(args.response)
+    cases = [(movie, languages) for movie in MOVIES for languages in LANGUAGES]
+    errors = check_rankings(cases, response)
+    for movie, languages in errors:
+        print(f"Ranking mismatch: {movie} {languages}")
+
+    # The ranking of each case, as cached
+    rankings = {}
+    for q in map(new_query, cases):
+        q.set_response(response)
+        rankings[q.movie_file_path, tuple(q.languages)] = q.ranking
+
+    def cached_best_match(q: Query, r: dict):
+        q.set_response(r, None, rankings[q.movie_file_path, tuple(q.languages)])
+        return q[0]
+
+    accesses = {
+        'best match': lambda q, r: (q.set_response(r), q[0]),
+        'top 20': lambda q, r: (q.set_response(r), q[:20]),
+        'iterate all': lambda q, r: (q.set_response(r), list(q)),
+        'full ranking': lambda q, r: (q.set_response(r), q.ranking),
+        'cached ranking, best match': cached_best_match,
+    }
+    rows = [[label, measure(access, cases, response, args.repeats) * 1e3] for label, access in accesses.items()]
+    print(tabulate.tabulate(rows, headers=(f"{len(response['data'])} rows response", "ms"), floatfmt=".3f"))
+    print()
+
+    row_size, result_size = measure_memory(cases, response)
+    print(tabulate.tabulate([["response row", row_size], ["result", result_size]], floatfmt=".0f",
+                            headers=(f"memory ({len(cases)} queries)", "bytes")))
+    print(f"{len(cases) - len(errors)}/{len(cases)} queries ranked as the reference ranking")
+
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
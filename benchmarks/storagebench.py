@@ -0,0 +1,87 @@
+"""
+Lookup latency benchmark of the cache storage backends (FileSystemStorage and SQLiteStorage), at several cache sizes.
+Each backend is filled with the entries, and then reopened (as by a new process) before its lookups are timed.
+
+    python -m benchmarks.storagebench
+    python -m benchmarks.storagebench --entries 10000 100000 --dir /var/tmp
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import tabulate
+
+from opensubtitles.api.storage import CacheStorage, FileSystemStorage, SQLiteStorage
+
+NAMESPACE = "queries"
+
+BACKENDS: Dict[str, Callable[[str], CacheStorage]] = {
+    'files': FileSystemStorage,
+    'sqlite': lambda cache_dir: SQLiteStorage(os.path.join(cache_dir, 'cache.sqlite3')),
+}
+
+
+def entry_key(i: int) -> str:
+    """ :return: a key like the cache keys (a query hash) """
+    return hashlib.sha256(str(i).encode('ascii')).hexdigest()
+
+
+def fill(storage: CacheStorage, entries: int, entry_size: int):
+    content = os.urandom(entry_size)
+    for i in range(entries):
+        storage.write(NAMESPACE, entry_key(i), content)
+
+
+def time_lookups(storage: CacheStorage, keys: List[str]) -> List[float]:
+    """ :return: the latency of each lookup in seconds """
+    latencies = []
+    for key in keys:
+        start = time.perf_counter()
+        entry = storage.read(NAMESPACE, key)
+        latencies.append(time.perf_counter() - start)
+        if entry is None:
+            raise KeyError(key)
+    return latencies
+
+
+def main():
+    p = argparse.ArgumentParser(description="Cache storage backends lookup latency benchmark")
+    p.add_argument("-n", "--entries", type=int, nargs="+", default=[10000, 100000], help="The cache sizes")
+    p.add_argument("-s", "--entry-size", type=int, default=2048, help="The size of each entry in bytes")
+    p.add_argument("-l", "--lookups", type=int, default=5000, help="The number of timed lookups")
+    p.add_argument("--dir", default=None, help="Where to create the caches (default: the temporary dir)")
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    r = random.Random(args.seed)
+    rows = []
+    for entries in args.entries:
+        keys = [entry_key(r.randrange(entries)) for _ in range(args.lookups)]
+        for backend, create_storage in BACKENDS.items():
+            with tempfile.TemporaryDirectory(prefix="opensubtitles-storagebench-", dir=args.dir) as cache_dir:
+                storage = create_storage(cache_dir)
+                start = time.perf_counter()
+                fill(storage, entries, args.entry_size)
+                fill_time = time.perf_counter() - start
+                storage.close()
+
+                storage = create_storage(cache_dir)
+                # The first read of each entry updates its access time, so a lookup pass precedes the timed one
+                time_lookups(storage, keys)
+                latencies = sorted(time_lookups(storage, keys))
+                storage.close()
+
+            rows.append([entries, backend, fill_time / entries * 1e6, statistics.median(latencies) * 1e6,
+                         latencies[int(len(latencies) * .99)] * 1e6])
+
+    print(tabulate.tabulate(rows, floatfmt=".1f", headers=(
+        "entries", "backend", "write µs", "lookup µs (median)", "lookup µs (p99)")))
+
+
+if __name__ == "__main__":
+    main()
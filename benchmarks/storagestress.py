@@ -0,0 +1,153 @@
+"""
+Multi-process stress test of FileSystemStorage: several processes write, read, and force evictions of the same
+keys in a single cache dir. Each entry is self-validating (it starts with its key, size and digest), so a torn
+or mixed entry is detected by the readers. Fails on any torn read, any exception in a process, or leftover
+temporary files.
+
+    python -m benchmarks.storagestress
+    python -m benchmarks.storagestress --processes 16 --operations 5000 --dir /mnt/shared
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import queue
+import random
+import sys
+import tempfile
+import time
+import traceback
+from typing import Dict, Optional
+
+import tabulate
+
+from opensubtitles.api import storage
+from opensubtitles.api.storage import FileSystemStorage
+
+NAMESPACES = "queries", "subtitles"
+COUNTERS = "writes", "reads", "hits", "evictions", "evicted", "torn", "errors"
+
+
+def encode_entry(key: str, payload: bytes) -> bytes:
+    digest = hashlib.sha256(payload).hexdigest()
+    return f"{key}:{len(payload)}:{digest}\n".encode('ascii') + payload
+
+
+def is_valid_entry(key: str, content: bytes) -> bool:
+    header, _, payload = content.partition(b"\n")
+    try:
+        entry_key, size, digest = header.decode('ascii').split(":")
+    except ValueError:
+        return False
+    return entry_key == key and int(size) == len(payload) and hashlib.sha256(payload).hexdigest() == digest
+
+
+def worker(cache_dir: str, seed: int, args: argparse.Namespace, results):
+    # Update the access time on every read, and rescan the namespaces on every eviction, to maximize the races
+    storage.ACCESS_RESOLUTION_SECONDS = 0
+    storage.RESCAN_INTERVAL_SECONDS = 0
+
+    r = random.Random(seed)
+    counters = dict.fromkeys(COUNTERS, 0)
+    fs = FileSystemStorage(cache_dir)
+    for _ in range(args.operations):
+        namespace = r.choice(NAMESPACES)
+        key = f"{r.randrange(args.keys):08x}"
+        operation = r.random()
+        try:
+            if operation < args.write_ratio:
+                payload = r.randbytes(r.randint(1, args.max_entry_size))
+                # Some entries are already expired, so they are evicted by the other processes
+                created = time.time() - (3600 if r.random() < .2 else 0)
+                fs.write(namespace, key, encode_entry(key, payload), created)
+                counters["writes"] += 1
+            elif operation < 1 - args.eviction_ratio:
+                entry = fs.read(namespace, key)
+                counters["reads"] += 1
+                if entry is not None:
+                    counters["hits"] += 1
+                    if not is_valid_entry(key, entry[0]):
+                        counters["torn"] += 1
+            else:
+                with fs.eviction_lock() as acquired:
+                    if acquired:
+                        counters["evictions"] += 1
+                        counters["evicted"] += fs.evict(namespace, time.time() - 60)
+                        counters["evicted"] += fs.evict_lru(namespace, max_entries=args.keys // 2)
+        except Exception:
+            counters["errors"] += 1
+            traceback.print_exc()
+    fs.close()
+    results.put((seed, counters))
+
+
+def check_cache_dir(cache_dir: str) -> Dict[str, int]:
+    """ :return: the number of invalid entries and leftover temporary files, after all the processes exited """
+    fs = FileSystemStorage(cache_dir, read_only=True)
+    invalid = 0
+    leftovers = 0
+    for namespace in NAMESPACES:
+        for key in fs.keys(namespace):
+            entry = fs.read(namespace, key)
+            if entry is not None and not is_valid_entry(key, entry[0]):
+                invalid += 1
+        leftovers += sum(1 for name in os.listdir(fs.namespace_path(namespace)) if name.endswith('.tmp'))
+    return {'invalid': invalid, 'leftovers': leftovers}
+
+
+def run(cache_dir: str, args: argparse.Namespace) -> Optional[Dict[int, Dict[str, int]]]:
+    """ :return: the counters of each process (None if a process failed) """
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(cache_dir, seed, args, results))
+                 for seed in range(args.processes)]
+    for p in processes:
+        p.start()
+    counters = {}
+    while len(counters) < len(processes):
+        try:
+            seed, process_counters = results.get(timeout=1)
+        except queue.Empty:
+            if not any(p.is_alive() for p in processes):
+                break
+            continue
+        counters[seed] = process_counters
+    for p in processes:
+        p.join()
+    if len(counters) != len(processes) or any(p.exitcode for p in processes):
+        return None
+    return counters
+
+
+def main():
+    p = argparse.ArgumentParser(description="FileSystemStorage multi-process stress test")
+    p.add_argument("-p", "--processes", type=int, default=8)
+    p.add_argument("-n", "--operations", type=int, default=3000, help="The number of operations of each process")
+    p.add_argument("-k", "--keys", type=int, default=64, help="The number of keys (of each namespace)")
+    p.add_argument("-s", "--max-entry-size", type=int, default=64 * 1024)
+    p.add_argument("--write-ratio", type=float, default=.4)
+    p.add_argument("--eviction-ratio", type=float, default=.05)
+    p.add_argument("--dir", default=None, help="Where to create the cache dir (default: the temporary dir)")
+    args = p.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="opensubtitles-storagestress-", dir=args.dir) as cache_dir:
+        start = time.perf_counter()
+        counters = run(cache_dir, args)
+        elapsed = time.perf_counter() - start
+        if counters is None:
+            print("A stress process failed")
+            sys.exit(1)
+        final = check_cache_dir(cache_dir)
+
+    totals = {k: sum(c[k] for c in counters.values()) for k in COUNTERS}
+    rows = [[seed, *(c[k] for k in COUNTERS)] for seed, c in sorted(counters.items())]
+    rows.append(["total", *totals.values()])
+    print(tabulate.tabulate(rows, headers=("process", *COUNTERS)))
+    print(f"{args.processes} processes, {args.processes * args.operations / elapsed:.0f} operations/s, "
+          f"{final['invalid']} invalid entries and {final['leftovers']} temporary files left")
+
+    if totals["torn"] or totals["errors"] or any(final.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
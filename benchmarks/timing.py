@@ -0,0 +1,19 @@
+import time
+from typing import Callable, Optional
+
+
+def best_time(func: Callable[[], object], repeats: int, number: int = 1,
+              setup: Optional[Callable[[], object]] = None) -> float:
+    """
+    :param setup: Called (untimed) before each repeat
+    :return: the time of a single call in seconds (the best of the repeats)
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
@@ -27,6 +27,7 @@ from typing import Dict, Optional
 from gi.repository import Gio, GLib, GObject, Peas
 
 from opensubtitles.api import OpenSubtitlesApi
+from opensubtitles.api.hash import hash_gio_file
 from opensubtitles.api.results import SUPPORTED_SUBTITLES_EXT
 from opensubtitles.language_settings import LanguageSetting
 from opensubtitles.plugin_logger import plugin_logger
@@ -191,7 +192,7 @@ class OpenSubtitles(GObject.Object, Peas.Activatable):
         self.disable()
 
     def __on_menu_set_subtitle(self, _action, params):
-        params = {p: params[i] for i, p in enumerate(['format', 'id-sub'])}
+        params = {p: params[i] for i, p in enumerate(['format', 'id-sub', 'sub-hash'])}
         self.submit_download_request(params)
 
     #####################################################################
@@ -221,12 +222,42 @@ class OpenSubtitles(GObject.Object, Peas.Activatable):
                                     [selected_dict], self.handle_downloaded_subtitle)
 
     def search_subtitles(self, refresh_cache: bool):
-        movie_file_path = self.movie_file().get_path()
-        return self.api.search_subtitles(self.language.list, movie_file_path, refresh_cache=refresh_cache)
+        # Stale cached results are shown right away, and updated once they are refreshed
+        mrl = self.mrl_filename
+
+        def on_refresh(results):
+            GLib.idle_add(self.__on_search_refreshed, mrl, results)
+
+        movie_file = self.movie_file()
+        movie_file_path = movie_file.get_path()
+        if movie_file_path is not None:
+            return self.api.search_subtitles(self.language.list, movie_file_path, refresh_cache=refresh_cache,
+                                             on_refresh=on_refresh)
+
+        # Non-local file (e.g., not FUSE-mounted GVfs share): hash it over GIO
+        movie_name = movie_file.get_basename()
+        try:
+            movie_hash = hash_gio_file(movie_file)
+        except Exception as e:
+            plugin_logger.exception("Failed hashing %s: %s", movie_file.get_uri(), e)
+            return self.api.search_subtitles_with_title(self.language.list, movie_file_path=movie_name,
+                                                        refresh_cache=refresh_cache, on_refresh=on_refresh)
+        return self.api.search_subtitles(self.language.list, movie_name, refresh_cache=refresh_cache,
+                                         movie_hash=movie_hash, on_refresh=on_refresh)
+
+    def __on_search_refreshed(self, mrl, results):
+        if mrl == self.mrl_filename:
+            try:
+                self.handle_search_results(results)
+            except Exception as e:
+                plugin_logger.exception(e)
+        # Run once
+        return False
 
     def download_subtitles(self, selected_dict: Dict[str, str]):
         subtitle_format = selected_dict['format']
-        content = self.api.download_subtitles(selected_dict['id-sub'], subtitle_format)
+        sub_hash = selected_dict.get('sub-hash', None)
+        content = self.api.download_subtitles(selected_dict['id-sub'], sub_hash=sub_hash)
         return self.save_subtitles(content, subtitle_format)
 
     def handle_search_results(self, results: Optional[api.Query], feeling_lucky=False):
@@ -238,7 +269,7 @@ class OpenSubtitles(GObject.Object, Peas.Activatable):
 
         if feeling_lucky and results.has_results:
             r = results[0]
-            self.submit_download_request({'format': r.ext, 'id': r.id})
+            self.submit_download_request({'format': r.ext, 'id-sub': r.id, 'sub-hash': r.sub_hash or ''})
 
     def _populate_treeview(self, results: api.Query):
         item_list = []
@@ -255,7 +286,8 @@ class OpenSubtitles(GObject.Object, Peas.Activatable):
             menu_title = u'\t%s: %s' % (lang_name, file_name)
             menu_item = Gio.MenuItem.new(gettext.gettext(menu_title), "app.set-opensubtitles")
 
-            menu_item.set_action_and_target_value("app.set-opensubtitles", GLib.Variant('as', [r.ext, r.id]))
+            menu_item.set_action_and_target_value("app.set-opensubtitles",
+                                                  GLib.Variant('as', [r.ext, r.id, r.sub_hash or '']))
             self.subs_menu.append_item(menu_item)
 
     def get_existing_subtitles_files(self):
@@ -323,20 +355,13 @@ class OpenSubtitles(GObject.Object, Peas.Activatable):
     def movie_file(self):
         return Gio.file_new_for_uri(self.mrl_filename)
 
-    def subtitle_path(self, ext):
-        return os.path.join(self._movie_dir(), f"{self.movie_name()}.{ext}")
-
     def subtitle_file(self, ext) -> Gio.File:
-        return Gio.file_new_for_path(self.subtitle_path(ext))
+        # Resolved relative to the movie's parent, so it works for non-local files as well
+        return self.movie_file().get_parent().get_child(f"{self.movie_name()}.{ext}")
 
     def is_subtitle_exists(self):
         return any(self.subtitle_file(ext).query_exists() for ext in SUPPORTED_SUBTITLES_EXT)
 
-    def _movie_dir(self):
-        directory = Gio.file_new_for_uri(self.mrl_filename)
-        parent = directory.get_parent()
-        return parent.get_path()
-
     ########################################################
     # Background Work
     ########################################################
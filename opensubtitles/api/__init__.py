@@ -29,13 +29,12 @@ import zlib
 from base64 import b64decode
 from io import BytesIO
 from pathlib import Path
-from typing import List, Optional
+from typing import Callable, List, Optional, Sequence, Tuple
 
 import requests
 
 from opensubtitles.api.cache import QueryCache
-from opensubtitles.api.filenameparser import parse_filename
-from opensubtitles.api.hash import hash_file
+from opensubtitles.api.filenameparser import FileProperties, parse_filename, parse_filename_cache_info
 from opensubtitles.api.lang import Languages
 from opensubtitles.api.results import Query, SUPPORTED_SUBTITLES_EXT
 
@@ -44,6 +43,8 @@ OPENSUBTITLES_RPC = 'https://api.opensubtitles.org:443/xml-rpc'
 
 OK200 = '200 OK'
 
+RefreshCallback = Callable[[Query], None]
+
 
 class OpenSubtitlesApi:
     """
@@ -53,7 +54,11 @@ class OpenSubtitlesApi:
 
     ERROR_MESSAGE_FMT = u'OpenSubtitles %s: %s'
 
-    def __init__(self, user_agent, username='', password='', cache_dir: Optional[str] = None):
+    def __init__(self, user_agent, username='', password='', cache_dir: Optional[str] = None,
+                 cache_backend: str = 'files', shared_cache_dirs: Sequence[str] = ()):
+        """
+        :param shared_cache_dirs: Read-only cache dirs, that are looked up after the local cache (see QueryCache)
+        """
         self.logger = logging.getLogger("opensubtitles-api")
         self.logger.addHandler(logging.StreamHandler())
         self.logger.setLevel(logging.DEBUG)
@@ -64,7 +69,8 @@ class OpenSubtitlesApi:
         self._token = None
         self._lock = threading.RLock()
 
-        self._cache = QueryCache(cache_dir)
+        self._cache = QueryCache(cache_dir, backend=cache_backend, shared_cache_dirs=shared_cache_dirs)
+        self._refreshing = set()
 
     ################################################################
     # Login/out
@@ -125,57 +131,131 @@ class OpenSubtitlesApi:
     ################################################################
 
     def search_subtitles_with_title(self, languages: List[str], movie_title: Optional[str] = None,
-                                    movie_file_path: Optional[str] = None, refresh_cache=False):
-        if movie_file_path is not None:
+                                    movie_file_path: Optional[str] = None, refresh_cache=False,
+                                    on_refresh: Optional[RefreshCallback] = None,
+                                    movie_properties: Optional[FileProperties] = None):
+        """
+        :param movie_properties: The parsed movie_file_path (if it was already parsed)
+        """
+        if movie_properties is None and movie_file_path is not None:
             movie_properties = parse_filename(movie_file_path)
-            self.logger.debug("Movie properties: %s", movie_properties)
-        else:
-            movie_properties = {}
+            self.logger.debug("Movie properties: %s", dict(movie_properties))
 
-        if movie_title is None and "search-term" in movie_properties:
+        if movie_title is None and movie_properties is not None and "search-term" in movie_properties:
             movie_title = movie_properties["search-term"]
 
-        return self._make_query(languages, movie_file_path=movie_file_path, **{
+        return self._make_query(languages, movie_file_path=movie_file_path, movie_properties=movie_properties, **{
             'query': movie_title
-        }, refresh_cache=refresh_cache)
-
-    def search_subtitles_with_file(self, languages: List[str], movie_file_path: str, refresh_cache=False):
-        movie_hash, movie_size = hash_file(movie_file_path)
-        return self._make_query(languages, movie_file_path=movie_file_path, **{
+        }, refresh_cache=refresh_cache, on_refresh=on_refresh)
+
+    def search_subtitles_with_file(self, languages: List[str], movie_file_path: str, refresh_cache=False,
+                                   on_refresh: Optional[RefreshCallback] = None,
+                                   movie_properties: Optional[FileProperties] = None):
+        movie_hash, movie_size = self._cache.movie_hashes.hash_file(movie_file_path)
+        return self.search_subtitles_with_hash(languages, movie_hash, movie_size, movie_file_path=movie_file_path,
+                                               refresh_cache=refresh_cache, on_refresh=on_refresh,
+                                               movie_properties=movie_properties)
+
+    def search_subtitles_with_hash(self, languages: List[str], movie_hash: str, movie_size: int,
+                                   movie_file_path: Optional[str] = None, refresh_cache=False,
+                                   on_refresh: Optional[RefreshCallback] = None,
+                                   movie_properties: Optional[FileProperties] = None):
+        return self._make_query(languages, movie_file_path=movie_file_path, movie_properties=movie_properties, **{
             'moviehash': movie_hash,
             'moviebytesize': str(movie_size)
-        }, refresh_cache=refresh_cache)
+        }, refresh_cache=refresh_cache, on_refresh=on_refresh)
 
-    def _make_query(self, languages: List[str], refresh_cache=False, **kwargs) -> Query:
+    def _make_query(self, languages: List[str], refresh_cache=False, on_refresh: Optional[RefreshCallback] = None,
+                    **kwargs) -> Query:
+        """
+        :param on_refresh: Allow returning a stale cached response. It is refreshed in the background,
+                           and the refreshed query is passed to this callback (from the background thread).
+        """
         query = Query(self, languages, **kwargs)
         if not refresh_cache and not query.has_response:
-            self._cache.read_cached_query(query)
+            self._cache.read_cached_query(query, allow_stale=on_refresh is not None)
         if not query.has_response:
-            query.set_response(
-                self.query(lambda t: self._server.SearchSubtitles(t, [query.query_data]))
-            )
-            self._cache.write_cached_query(query)
+            self._fetch_query(query)
+        elif query.is_stale:
+            self._refresh_query_in_background(languages, kwargs, on_refresh)
         return query
 
+    def _fetch_query(self, query: Query):
+        """ Fetch only the languages of the query that are missing from the cache """
+        query_data = {**query.query_data, 'sublanguageid': ",".join(query.missing_languages)}
+        with self._cache.stats.timer("server.search"):
+            response = self.query(lambda t: self._server.SearchSubtitles(t, [query_data]))
+        query.set_response(self._cache.merge_cached_shards(query, response))
+        self._cache.write_cached_query(query)
+
+    def _refresh_query_in_background(self, languages: List[str], query_kwargs: dict, on_refresh: RefreshCallback):
+        query = Query(self, languages, **query_kwargs)
+        with self._lock:
+            if query.query_hash in self._refreshing:
+                return
+            self._refreshing.add(query.query_hash)
+
+        def refresh():
+            try:
+                self.logger.debug("Refreshing stale query: %s", query.query_data)
+                self._fetch_query(query)
+                # Rank all the results here, so the callback (e.g., on the UI thread) gets a ranked query,
+                # and the ranking is written to the cache by this thread
+                len(query)
+                on_refresh(query)
+            except Exception as e:
+                self.logger.error("Failed refreshing stale query: %s", e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(query.query_hash)
+
+        threading.Thread(target=refresh, daemon=True).start()
+
     def search_subtitles(self, languages: List[str], movie_file_path: Optional[str] = None,
-                         movie_title: Optional[str] = None, refresh_cache=False):
+                         movie_title: Optional[str] = None, refresh_cache=False,
+                         movie_hash: Optional[Tuple[str, int]] = None, on_refresh: Optional[RefreshCallback] = None):
+        """
+        Search by the movie hash, and fall back to search by title.
+        :param movie_hash: A precomputed (hash, size) of the movie. Otherwise, it is computed from movie_file_path.
+        :param on_refresh: Allow returning stale cached results, that are refreshed in the background.
+                           See _make_query().
+        """
+        # Parsed once, for all the queries
+        movie_properties = None
         if movie_file_path is not None:
-            q = self.search_subtitles_with_file(languages, movie_file_path, refresh_cache=refresh_cache)
+            movie_properties = parse_filename(movie_file_path)
+            self.logger.debug("Movie properties: %s", dict(movie_properties))
+
+        q = None
+        if movie_hash is not None:
+            q = self.search_subtitles_with_hash(languages, *movie_hash, movie_file_path=movie_file_path,
+                                                refresh_cache=refresh_cache, on_refresh=on_refresh,
+                                                movie_properties=movie_properties)
+        elif movie_file_path is not None:
+            q = self.search_subtitles_with_file(languages, movie_file_path, refresh_cache=refresh_cache,
+                                                on_refresh=on_refresh, movie_properties=movie_properties)
+        if q is not None:
             if q.has_results:
                 return q
             self.logger.debug("Failed getting subtitles using movie file metadata. Trying with title.")
 
         return self.search_subtitles_with_title(
-            languages, movie_title, movie_file_path=movie_file_path, refresh_cache=refresh_cache
+            languages, movie_title, movie_file_path=movie_file_path, refresh_cache=refresh_cache,
+            on_refresh=on_refresh, movie_properties=movie_properties
         )
 
-    def download_subtitles(self, subtitle_id, refresh_cache=False) -> bytes:
+    def download_subtitles(self, subtitle_id, refresh_cache=False, sub_hash: Optional[str] = None) -> bytes:
+        """
+        :param sub_hash: The SubHash of the subtitles (from the search results). The download is skipped if
+                         subtitles with the same content are already cached.
+        """
         if not refresh_cache:
-            content = self._cache.read_cached_subtitles(str(subtitle_id))
+            content = self._cache.read_cached_subtitles(str(subtitle_id), sub_hash)
             if content is not None:
                 return content
 
-        res = requests.get(f"http://www.opensubtitles.org/download/sub/{subtitle_id}")
+        with self._cache.stats.timer("server.download"):
+            res = requests.get(f"http://www.opensubtitles.org/download/sub/{subtitle_id}")
         if res.status_code != 200:
             raise Exception(f"Failed fetching subtitles [{subtitle_id}]. Status code: {res.status_code}.")
 
@@ -187,6 +267,22 @@ class OpenSubtitlesApi:
             self.logger.error("Failed parsing subtitles: %s", e)
             raise Exception(u"Parse subtitles error:" % e)
 
+    def stats(self) -> dict:
+        """
+        :return: the cache and download counters (hits, misses, stale hits, evictions, bytes read/written),
+                 latency histograms, and the hit rate of the parsed file names
+        """
+        stats = self._cache.stats.as_dict()
+        parser_info = parse_filename_cache_info()
+        lookups = parser_info.hits + parser_info.misses
+        stats['parser'] = {
+            'hits': parser_info.hits,
+            'misses': parser_info.misses,
+            'entries': parser_info.currsize,
+            'hit-rate': parser_info.hits / lookups if lookups else 0.,
+        }
+        return stats
+
     @staticmethod
     def subtitle_path(movie_path, ext):
         dir_name = os.path.dirname(movie_path)
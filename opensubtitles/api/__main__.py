@@ -2,6 +2,8 @@ import argparse
 import logging
 import os
 
+import tabulate
+
 from opensubtitles.api import OpenSubtitlesApi
 from opensubtitles.api.lang import LANGUAGES_ALL_TO_3
 
@@ -13,6 +15,16 @@ def extant_file_exist(input_path: str) -> str:
     return path
 
 
+def print_stats(stats: dict):
+    print(tabulate.tabulate(list(stats['counters'].items()), headers=("counter", "value")))
+    print()
+    latency = [[name, *histogram.values()] for name, histogram in stats['latency'].items()]
+    headers = ("latency", *next(iter(stats['latency'].values()), {}).keys())
+    print(tabulate.tabulate(latency, headers=headers, floatfmt=".3f"))
+    print()
+    print(tabulate.tabulate(list(stats['parser'].items()), headers=("parser", "value"), floatfmt=".3f"))
+
+
 def main():
     logging.basicConfig(level=logging.DEBUG)
     p = argparse.ArgumentParser(description="Opensubtitles.org Downloader")
@@ -21,19 +33,25 @@ def main():
     p.add_argument("-o", "--op", action="append", default=["query"], choices=["query", "download"])
     p.add_argument("-i", "--index", type=int)
     p.add_argument("-l", "--language", nargs="*", default=["he", "en"], choices=LANGUAGES_ALL_TO_3.keys())
+    p.add_argument("-s", "--stats", action="store_true", help="Print the cache statistics")
+    p.add_argument("-c", "--shared-cache-dir", action="append", default=[],
+                   help="A read-only cache dir, that is looked up after the local cache")
     args = p.parse_args()
 
     if args.file_path is None and args.title is None:
         raise Exception("Must supply either file-path or title")
 
-    open_sub = OpenSubtitlesApi('Totem')
+    open_sub = OpenSubtitlesApi('Totem', shared_cache_dirs=args.shared_cache_dir)
     for op in args.op:
         if op == "query":
-            ret = open_sub.search_subtitles(args.languages, movie_file_path=args.file_path, movie_title=args.title)
+            ret = open_sub.search_subtitles(args.language, movie_file_path=args.file_path, movie_title=args.title)
             print(ret)
         elif op == "download":
             pass
 
+    if args.stats:
+        print_stats(open_sub.stats())
+
 
 if __name__ == "__main__":
     main()
@@ -1,15 +1,56 @@
+import hashlib
 import json
 import logging
 import os
 import tempfile
-from datetime import datetime
-from typing import Optional
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
 
-from opensubtitles.api.results import Query
+from opensubtitles.api.filenameparser import freeze_properties, PARSER_VERSION
+from opensubtitles.api.hash import hash_file
+from opensubtitles.api.results import ALL_LANGUAGES, Query, SCORING_VERSION
+from opensubtitles.api.stats import CacheStats
+from opensubtitles.api.storage import CacheEntry, CacheStorage, FileSystemStorage, migrate_storage, SQLiteStorage
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 SECONDS_PER_DAY = float(60 * 60 * 24)
 CACHE_LIFETIME_DAYS = 1
 SUBS_CACHE_LIFETIME_DAYS = 7
+STALE_CACHE_LIFETIME_DAYS = 7
+NEGATIVE_CACHE_LIFETIME_DAYS = 3 / 24
+NEGATIVE_CACHE_MAX_ENTRIES = 10000
+CACHE_MAX_BYTES = 64 * 2 ** 20
+SUBS_CACHE_MAX_BYTES = 256 * 2 ** 20
+MEMORY_CACHE_MAX_BYTES = 16 * 2 ** 20
+EVICTION_INTERVAL_SECONDS = 10 * 60
+MOVIE_HASH_INDEX_LIFETIME_DAYS = 365
+MOVIE_HASH_INDEX_MAX_ENTRIES = 10000
+# Rankings of the same response, for different movie files (e.g., a title search shared by several files)
+MAX_RANKINGS_PER_QUERY = 16
+RANKING_VERSION = f"{PARSER_VERSION}.{SCORING_VERSION}"
+# The fields of a response row that affect its parsed properties and its rank
+RANKING_FIELDS = 'IDSubtitleFile', 'SubFileName', 'SubFormat', 'SubLanguageID', 'SubRating'
+
+# Compressed entries start with a magic followed by a single byte of the codec.
+# Entries without the magic are stored uncompressed (as written by older versions).
+COMPRESSION_MAGIC = b'\x89OSC'
+COMPRESSION_CODECS = {'zlib': b'z', 'zstd': b's'}
+DEFAULT_COMPRESSION = 'zstd' if zstandard is not None else 'zlib'
+
+# The fields of the response rows that are kept in the cache (the rest are dropped), and the
+# version of the compact (list of rows) representation of the cached responses.
+RESPONSE_FIELDS = (
+    'IDSubtitleFile', 'IDSubtitle', 'SubFileName', 'SubLanguageID', 'SubFormat', 'SubRating', 'SubSize', 'SubHash',
+    'IDMovie', 'IDMovieImdb', 'MovieName', 'MovieYear', 'SeriesSeason', 'SeriesEpisode', 'SubDownloadsCnt',
+)
+COMPACT_RESPONSE_VERSION = 1
 
 try:
     from appdirs import user_cache_dir
@@ -18,84 +59,592 @@ except ImportError:
         return tempfile.mkdtemp()
 
 
+class MovieHashIndex:
+    """
+    Persistent index of movie hashes keyed by the file identity: (device, inode) -> (size, mtime_ns, hash).
+    A modified file no longer matches its entry and is rehashed, while a renamed file keeps its inode
+    and its hash.
+    Each file is a separate entry of the storage, so a new hash is a single small write, and processes that
+    share the storage do not overwrite each other's entries.
+    """
+
+    def __init__(self, storage: CacheStorage, namespace: str):
+        self.logger = logging.getLogger("opensubtitles-cache")
+        self._storage = storage
+        self._namespace = namespace
+
+    @staticmethod
+    def file_identity(stat: os.stat_result) -> str:
+        return f"{stat.st_dev}-{stat.st_ino}"
+
+    def _lookup(self, stat: os.stat_result) -> Optional[Tuple[str, int]]:
+        try:
+            cached = self._storage.read(self._namespace, self.file_identity(stat))
+            entry = json.loads(cached[0]) if cached is not None else None
+        except (OSError, ValueError) as e:
+            self.logger.warning("Failed reading movie hash index entry: %s", e)
+            return None
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            return None
+        return entry['hash'], entry['size']
+
+    def add(self, stat: os.stat_result, movie_hash: str):
+        entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': movie_hash}
+        try:
+            self._storage.write(self._namespace, self.file_identity(stat), json.dumps(entry).encode('utf8'))
+        except OSError as e:
+            self.logger.error("Failed saving movie hash index entry: %s", e)
+
+    def hash_file(self, file_path: str) -> Tuple[str, int]:
+        stat = os.stat(file_path)
+        cached = self._lookup(stat)
+        if cached is not None:
+            return cached
+
+        movie_hash, movie_size = hash_file(file_path)
+        self.add(stat, movie_hash)
+        return movie_hash, movie_size
+
+
+class CachePolicy(NamedTuple):
+    """
+    Eviction policy of a cache namespace.
+    Entries expire after lifetime_days, and once the namespace exceeds max_bytes or max_entries,
+    the least recently accessed entries are evicted.
+    Expired entries are kept for additional stale_days, so they can be served while being refreshed.
+    """
+    lifetime_days: float
+    max_bytes: Optional[int] = None
+    max_entries: Optional[int] = None
+    stale_days: float = 0
+
+    @property
+    def lifetime_seconds(self) -> float:
+        return self.lifetime_days * SECONDS_PER_DAY
+
+    @property
+    def retention_seconds(self) -> float:
+        return (self.lifetime_days + self.stale_days) * SECONDS_PER_DAY
+
+
+def project_response(response: dict, fields=RESPONSE_FIELDS) -> dict:
+    """ :return: a copy of the response with only the given fields of the data rows """
+    data = response.get('data', None)
+    if not data:
+        return response
+    return {**response, 'data': [{k: r[k] for k in fields if k in r} for r in data]}
+
+
+def encode_compact_response(response: dict) -> bytes:
+    """
+    Encode the data rows as lists of values, with a single list of the field names.
+    Missing fields are encoded as null (the response values are never null).
+    """
+    data = response.get('data', None)
+    if not data:
+        return json.dumps(response).encode('utf8')
+    fields = list(dict.fromkeys(k for r in data for k in r))
+    compact = {k: v for k, v in response.items() if k != 'data'}
+    compact['compact-response'] = COMPACT_RESPONSE_VERSION
+    compact['fields'] = fields
+    compact['rows'] = [[r.get(k, None) for k in fields] for r in data]
+    return json.dumps(compact, separators=(',', ':')).encode('utf8')
+
+
+def decode_compact_response(content: bytes) -> dict:
+    """ Decode both a compact response and a full response (as written by older versions) """
+    response = json.loads(content)
+    version = response.pop('compact-response', None)
+    if version is None:
+        return response
+    if version != COMPACT_RESPONSE_VERSION:
+        raise ValueError(f"Unsupported compact response version: {version}")
+    fields = response.pop('fields')
+    response['data'] = [{k: v for k, v in zip(fields, row) if v is not None} for row in response.pop('rows')]
+    return response
+
+
+def compress_entry(content: bytes, codec: Optional[str] = DEFAULT_COMPRESSION) -> bytes:
+    if codec is None:
+        return content
+    if codec == 'zstd':
+        compressed = zstandard.ZstdCompressor().compress(content)
+    elif codec == 'zlib':
+        compressed = zlib.compress(content)
+    else:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    return COMPRESSION_MAGIC + COMPRESSION_CODECS[codec] + compressed
+
+
+def decompress_entry(content: bytes) -> bytes:
+    if not content.startswith(COMPRESSION_MAGIC):
+        return content
+    header_size = len(COMPRESSION_MAGIC) + 1
+    codec = content[len(COMPRESSION_MAGIC):header_size]
+    if codec == COMPRESSION_CODECS['zlib']:
+        return zlib.decompress(content[header_size:])
+    if codec == COMPRESSION_CODECS['zstd'] and zstandard is not None:
+        return zstandard.ZstdDecompressor().decompress(content[header_size:])
+    raise ValueError(f"Unsupported compression codec: {codec}")
+
+
+class MemoryCache:
+    """
+    Bounded in-memory LRU of decoded entries, capped by the total size of their encoded content.
+    """
+
+    def __init__(self, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, int, float]]' = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """ :return: tuple (value, creation time) """
+        with self._lock:
+            entry = self._entries.get(key, None)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            value, _, created = entry
+            return value, created
+
+    def put(self, key: Hashable, value, size: int, created: float):
+        with self._lock:
+            self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = value, size, created
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def pop(self, key: Hashable):
+        with self._lock:
+            self._pop(key)
+
+
 class QueryCache:
-    def __init__(self, cache_dir: Optional[str] = None):
+    QUERIES = "queries"
+    # Subtitle id -> digest of its content (or the content itself, as written by older versions)
+    SUBTITLES = "subtitles"
+    # Subtitles content, addressed by its MD5 digest (the server's SubHash)
+    SUBTITLE_BLOBS = "subtitle-blobs"
+    # Queries without any results
+    MISSES = "misses"
+    # Parsed properties of the queries results, and their ranking (per movie file properties)
+    RANKINGS = "rankings"
+    # Movie file identity -> its hash (see MovieHashIndex)
+    MOVIE_HASHES = "movie-hashes"
+    NAMESPACES = QUERIES, SUBTITLES, SUBTITLE_BLOBS, MISSES, RANKINGS, MOVIE_HASHES
+
+    DIGEST_PREFIX = b'md5:'
+
+    DEFAULT_POLICIES = {
+        QUERIES: CachePolicy(CACHE_LIFETIME_DAYS, max_bytes=CACHE_MAX_BYTES, stale_days=STALE_CACHE_LIFETIME_DAYS),
+        SUBTITLES: CachePolicy(SUBS_CACHE_LIFETIME_DAYS, max_bytes=SUBS_CACHE_MAX_BYTES),
+        SUBTITLE_BLOBS: CachePolicy(SUBS_CACHE_LIFETIME_DAYS, max_bytes=SUBS_CACHE_MAX_BYTES),
+        MISSES: CachePolicy(NEGATIVE_CACHE_LIFETIME_DAYS, max_entries=NEGATIVE_CACHE_MAX_ENTRIES),
+        RANKINGS: CachePolicy(CACHE_LIFETIME_DAYS, max_bytes=CACHE_MAX_BYTES, stale_days=STALE_CACHE_LIFETIME_DAYS),
+        MOVIE_HASHES: CachePolicy(MOVIE_HASH_INDEX_LIFETIME_DAYS, max_entries=MOVIE_HASH_INDEX_MAX_ENTRIES),
+    }
+
+    def __init__(self, cache_dir: Optional[str] = None, backend: str = 'files',
+                 policies: Optional[Dict[str, CachePolicy]] = None, memory_max_bytes: int = MEMORY_CACHE_MAX_BYTES,
+                 compression: Optional[str] = DEFAULT_COMPRESSION, stats: Optional[CacheStats] = None,
+                 cache_rankings: bool = True, response_fields: Optional[Tuple[str, ...]] = RESPONSE_FIELDS,
+                 shared_cache_dirs: Sequence[str] = ()):
+        """
+        :param shared_cache_dirs: Read-only cache dirs (e.g., on a network share, filled by other hosts),
+                                  that are looked up in order after the local cache. Their hits are copied
+                                  to the local cache.
+        :param cache_rankings: Cache the parsed and ranked results along with the responses, so a cache hit
+                               does not parse and rank the results again.
+        :param response_fields: The fields of the response rows to cache. None to cache the full response.
+        """
         self.logger = logging.getLogger("opensubtitles-cache")
         if cache_dir is None:
             cache_dir = user_cache_dir()
         self._cache_dir = os.path.join(cache_dir, 'opensubtitles')
-        self.logger.info("Cache dir: %s", self._cache_dir)
+        self.logger.info("Cache dir: %s (%s)", self._cache_dir, backend)
+
+        if backend == 'files':
+            self._storage: CacheStorage = FileSystemStorage(self._cache_dir)
+        elif backend == 'sqlite':
+            self._storage = SQLiteStorage(os.path.join(self._cache_dir, 'cache.sqlite3'))
+            self._migrate_directory_cache()
+        else:
+            raise ValueError(f"Unknown cache backend: {backend}")
+        self._shared_storages = [FileSystemStorage(os.path.join(d, 'opensubtitles'), read_only=True)
+                                 for d in shared_cache_dirs]
+
+        self.movie_hashes = MovieHashIndex(self._storage, self.MOVIE_HASHES)
 
-    def _write_json_file(self, file_path, content: dict):
+        self.policies = dict(self.DEFAULT_POLICIES)
+        if policies is not None:
+            self.policies.update(policies)
+
+        self._eviction_lock = threading.Lock()
+        self._next_eviction = 0.
+
+        # Write-through memory tier of decoded entries, in front of the storage
+        self._memory = MemoryCache(memory_max_bytes)
+        if compression is not None and compression not in COMPRESSION_CODECS:
+            raise ValueError(f"Unknown compression codec: {compression}")
+        self.compression = compression
+
+        self.stats = stats if stats is not None else CacheStats()
+        self.cache_rankings = cache_rankings
+        self.response_fields = response_fields
+
+    def _migrate_directory_cache(self):
+        if not any(os.path.isdir(os.path.join(self._cache_dir, n)) for n in self.NAMESPACES):
+            return
+        migrated = migrate_storage(FileSystemStorage(self._cache_dir), self._storage, self.NAMESPACES)
+        self.logger.info("Migrated %s entries from the directory cache", migrated)
+        for namespace in self.NAMESPACES:
+            try:
+                os.rmdir(os.path.join(self._cache_dir, namespace))
+            except OSError:
+                pass
+
+    def _is_fresh(self, namespace: str, created: float) -> bool:
+        return time.time() - created <= self.policies[namespace].lifetime_seconds
+
+    def _is_retained(self, namespace: str, created: float) -> bool:
+        return time.time() - created <= self.policies[namespace].retention_seconds
+
+    def _write(self, namespace: str, key: str, value, encode: Callable[[Any], bytes] = bytes):
         self.clear_cache()
-        with open(file_path, 'w') as f:
-            json.dump(content, f)
+        content = encode(value)
+        stored_content = compress_entry(content, self.compression)
+        self._storage.write(namespace, key, stored_content)
+        self.stats.count(f"{namespace}.bytes-written", len(stored_content))
+        self._memory.put((namespace, key), value, len(content), time.time())
+
+    def _delete(self, namespace: str, key: str):
+        self._memory.pop((namespace, key))
+        self._storage.delete(namespace, key)
 
-    def _read_json_file(self, file_path: str) -> Optional[dict]:
+    def _lookup(self, namespace: str, key: str, decode: Callable[[bytes], Any]) -> Optional[Tuple[Any, float]]:
+        """
+        Lookup an entry, including a stale one (expired, but not yet evicted).
+        :return: tuple (value, creation time)
+        """
         self.clear_cache()
-        if not os.path.isfile(file_path):
+        cached = self._memory.get((namespace, key))
+        if cached is not None:
+            # A shared cache might have a fresher entry than a stale one
+            if self._is_fresh(namespace, cached[1]) or (
+                    not self._shared_storages and self._is_retained(namespace, cached[1])):
+                self.stats.count(f"{namespace}.memory-hits")
+                return cached
+            self._memory.pop((namespace, key))
+
+        entry = self._storage.read(namespace, key)
+        if entry is None or not self._is_fresh(namespace, entry[1]):
+            shared_entry = self._read_shared(namespace, key)
+            if shared_entry is not None and (entry is None or shared_entry[1] > entry[1]):
+                entry = shared_entry
+        if entry is None:
+            return None
+        content, created = entry
+        self.stats.count(f"{namespace}.bytes-read", len(content))
+        if not self._is_retained(namespace, created):
+            return None
+        try:
+            content = decompress_entry(content)
+            value = decode(content)
+        except Exception as e:
+            self.logger.error("Failed decoding cached entry %s/%s: %s", namespace, key, e)
             return None
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        self._memory.put((namespace, key), value, len(content), created)
+        return value, created
 
-    def _write_binary_file(self, file_path, content: bytes):
-        self.clear_cache()
-        with open(file_path, 'wb') as f:
-            f.write(content)
+    def _read_shared(self, namespace: str, key: str) -> Optional[CacheEntry]:
+        """ Lookup the shared caches in order, and copy a hit to the local cache (keeping its creation time) """
+        for storage in self._shared_storages:
+            try:
+                entry = storage.read(namespace, key)
+            except OSError as e:
+                self.logger.error("Failed reading shared cache entry %s/%s: %s", namespace, key, e)
+                continue
+            if entry is None or not self._is_retained(namespace, entry[1]):
+                continue
+            self.stats.count(f"{namespace}.shared-hits")
+            content, created = entry
+            try:
+                self._storage.write(namespace, key, content, created=created)
+            except OSError as e:
+                self.logger.error("Failed copying shared cache entry %s/%s: %s", namespace, key, e)
+            return entry
+        return None
 
-    def _read_binary_file(self, file_path: str) -> Optional[bytes]:
-        self.clear_cache()
-        if not os.path.isfile(file_path):
+    def _read(self, namespace: str, key: str, decode: Callable[[bytes], Any] = bytes):
+        cached = self._lookup(namespace, key, decode)
+        if cached is None:
+            return None
+        value, created = cached
+        if not self._is_fresh(namespace, created):
             return None
-        with open(file_path, 'rb') as f:
-            return f.read()
+        return value
 
-    @property
-    def cache_path(self):
-        os.makedirs(self._cache_dir, exist_ok=True)
-        return self._cache_dir
+    @staticmethod
+    def _encode_json(content: dict) -> bytes:
+        return json.dumps(content).encode('utf8')
 
-    @property
-    def query_cache_path(self):
-        path = os.path.join(self._cache_dir, "queries")
-        os.makedirs(path, exist_ok=True)
-        return path
+    def read_cached_query(self, query: Query, allow_stale=False):
+        """
+        Lookup a fresh response, then a (short-lived) negative response, and then a stale response.
+        :param allow_stale: Also set an expired (but retained) response, and mark the query as stale.
+        """
+        with self.stats.timer(f"{self.QUERIES}.lookup"):
+            outcome = self._read_cached_query(query, allow_stale)
+        self.stats.count(f"{self.QUERIES}.{outcome}")
+        return query
 
-    @property
-    def subtitles_cache_path(self):
-        path = os.path.join(self._cache_dir, "subtitles")
-        os.makedirs(path, exist_ok=True)
-        return path
+    def _lookup_shard(self, query: Query, language: str, allow_stale: bool) -> Tuple[Optional[dict], str]:
+        """ :return: tuple (the cached response of the language, the lookup outcome) """
+        shard_hash = query.shard_hash(language)
+        response, created = self._lookup(self.QUERIES, shard_hash, decode_compact_response) or (None, None)
+        if response is not None and self._is_fresh(self.QUERIES, created):
+            return response, "hits"
 
-    def query_cache_file(self, filename):
-        return os.path.join(self.query_cache_path, filename)
+        negative_response = self._read(self.MISSES, shard_hash, json.loads)
+        if negative_response is not None:
+            return negative_response, "negative-hits"
 
-    def subtitles_cache_file(self, sub_id):
-        return os.path.join(self.subtitles_cache_path, str(sub_id))
+        if response is not None and allow_stale:
+            return response, "stale-hits"
+        return None, "misses"
 
-    def read_cached_query(self, query: Query):
-        query.set_response(self._read_json_file(self.query_cache_file(query.query_hash)))
-        return query
+    def _read_cached_query(self, query: Query, allow_stale: bool) -> str:
+        """
+        Lookup the response of each of the query languages.
+        If some are missing, the found ones are kept in the query, and only the missing ones should be fetched.
+        :return: the lookup outcome
+        """
+        outcomes = {}
+        for language in query.shard_languages:
+            response, outcomes[language] = self._lookup_shard(query, language, allow_stale)
+            if response is not None:
+                query.cached_shards[language] = response
+
+        if "misses" in outcomes.values():
+            # The server is queried anyway, so the stale languages are refreshed as well
+            query.missing_languages = [l for l, outcome in outcomes.items() if outcome in ("misses", "stale-hits")]
+            for language in query.missing_languages:
+                query.cached_shards.pop(language, None)
+            return "partial-hits" if query.cached_shards else "misses"
+
+        query.missing_languages = []
+        response = self.assemble_shards(query.cached_shards)
+        if self.is_negative_response(response):
+            query.set_response(response)
+            return "negative-hits"
+
+        self._set_cached_response(query, response)
+        if "stale-hits" in outcomes.values():
+            query.is_stale = True
+            return "stale-hits"
+        return "hits"
+
+    @staticmethod
+    def split_shards(response: dict, languages: List[str]) -> Dict[str, dict]:
+        """ :return: the response of each language """
+        data = response.get('data', None) or []
+        return {l: {**response, 'data': [r for r in data if l == ALL_LANGUAGES or r.get('SubLanguageID', None) == l]}
+                for l in languages}
+
+    @staticmethod
+    def assemble_shards(shards: Dict[str, dict]) -> dict:
+        """
+        Assemble the responses of single languages into a single response.
+        The languages are ordered by their code, so the response does not depend on the query languages order
+        (the results are ranked by the query languages order).
+        """
+        responses = [shards[l] for l in sorted(shards)]
+        data = [r for response in responses for r in (response.get('data', None) or [])]
+        return {**responses[0], 'data': data}
+
+    @staticmethod
+    def is_assembled_response(response: dict) -> bool:
+        """
+        :return: whether the response rows are ordered as assembled from the cached languages
+                 (the cached ranking refers to this order)
+        """
+        languages = [r.get('SubLanguageID', None) or '' for r in response.get('data', None) or []]
+        return all(a <= b for a, b in zip(languages, languages[1:]))
+
+    def merge_cached_shards(self, query: Query, response: dict) -> dict:
+        """
+        :param response: The server response of the query missing languages
+        :return: the response of all the query languages
+        """
+        shards = dict(query.cached_shards)
+        shards.update(self.split_shards(response, query.missing_languages))
+        return self.assemble_shards(shards)
+
+    @staticmethod
+    def is_negative_response(response: dict) -> bool:
+        return not response.get('data', None)
+
+    @staticmethod
+    def response_digest(response: dict) -> str:
+        """ :return: digest of the response fields that affect the parsed and ranked results """
+        rows = ("\0".join(str(r.get(k, "")) for k in RANKING_FIELDS) for r in response['data'])
+        return hashlib.md5("\n".join(rows).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def ranking_digest(query: Query) -> str:
+        """ :return: digest of the query fields that affect the ranking: the languages order and the properties """
+        # The order of the properties values is arbitrary
+        properties = {k: sorted(v) if isinstance(v, (list, tuple)) else v for k, v in query.properties.items()}
+        return hashlib.md5(json.dumps([query.languages, properties], sort_keys=True).encode('utf8')).hexdigest()
+
+    @staticmethod
+    def _encode_rankings(entry: dict) -> bytes:
+        # The parsed properties are read-only mappings
+        return json.dumps(entry, default=dict).encode('utf8')
+
+    @staticmethod
+    def _decode_rankings(content: bytes) -> dict:
+        entry = json.loads(content)
+        entry['properties'] = [freeze_properties(p) if p is not None else None for p in entry['properties']]
+        return entry
+
+    def _read_rankings(self, query: Query, response: dict) -> Optional[dict]:
+        """ :return: the cached rankings entry of the response, unless it belongs to another version or response """
+        entry = self._read(self.RANKINGS, query.query_hash, self._decode_rankings)
+        if entry is None or entry['version'] != RANKING_VERSION or entry['digest'] != self.response_digest(response):
+            self.stats.count(f"{self.RANKINGS}.misses")
+            return None
+        self.stats.count(f"{self.RANKINGS}.hits")
+        return entry
+
+    def _write_rankings(self, query: Query, rankings: Optional[dict] = None):
+        """ Write the query ranking, and the properties that were parsed for it (the others are parsed on demand) """
+        ranking_digest = self.ranking_digest(query)
+        rankings = dict(rankings or {})
+        rankings.pop(ranking_digest, None)
+        rankings[ranking_digest] = query.ranking
+        for old_digest in list(rankings)[:max(0, len(rankings) - MAX_RANKINGS_PER_QUERY)]:
+            del rankings[old_digest]
+        self._write(self.RANKINGS, query.query_hash, {
+            'version': RANKING_VERSION,
+            'digest': self.response_digest(query.response),
+            'properties': query.parsed_properties,
+            'rankings': rankings,
+        }, self._encode_rankings)
+
+    def _write_rankings_when_ranked(self, query: Query, rankings: Optional[dict] = None):
+        """
+        Write the query ranking once all its results are ranked (e.g., iterated). Until then, the results are only
+        ranked as far as they are accessed, and the ranking is not cached.
+        """
+        def write_rankings():
+            try:
+                self._write_rankings(query, rankings)
+            except Exception as e:
+                self.logger.error("Failed writing the ranking of %s: %s", query.query_hash, e)
+
+        query.when_ranked(write_rankings)
+
+    def _set_cached_response(self, query: Query, response: dict):
+        if not self.cache_rankings:
+            query.set_response(response)
+            return
+
+        entry = self._read_rankings(query, response)
+        if entry is None:
+            query.set_response(response)
+            self._write_rankings_when_ranked(query)
+            return
+
+        ranking = entry['rankings'].get(self.ranking_digest(query), None)
+        query.set_response(response, entry['properties'], ranking)
+        if ranking is None:
+            self._write_rankings_when_ranked(query, entry['rankings'])
 
     def write_cached_query(self, query: Query):
-        if query.has_response:
-            self._write_json_file(self.query_cache_file(query.query_hash), query.response)
+        """ Write the response of each of the fetched (missing) languages of the query """
+        if not query.has_response:
+            return
+        for language, response in self.split_shards(query.response, query.missing_languages).items():
+            shard_hash = query.shard_hash(language)
+            if self.is_negative_response(response):
+                self._write(self.MISSES, shard_hash, response, self._encode_json)
+                continue
+            if self.response_fields is not None:
+                response = project_response(response, self.response_fields)
+            self._write(self.QUERIES, shard_hash, response, encode_compact_response)
+            self._delete(self.MISSES, shard_hash)
+
+        if self.cache_rankings and self.is_assembled_response(query.response):
+            self._write_rankings_when_ranked(query)
+
+    @staticmethod
+    def subtitles_digest(content: bytes) -> str:
+        return hashlib.md5(content).hexdigest()
+
+    def _read_subtitles(self, sub_id: str, sub_hash: Optional[str]) -> Optional[bytes]:
+        if sub_hash:
+            content = self._read(self.SUBTITLE_BLOBS, sub_hash.lower())
+            if content is not None:
+                reference = self.DIGEST_PREFIX + sub_hash.lower().encode('ascii')
+                # Map the id to the shared content once (not on every hit)
+                if self._read(self.SUBTITLES, sub_id) != reference:
+                    self._write(self.SUBTITLES, sub_id, reference)
+                return content
+
+        content = self._read(self.SUBTITLES, sub_id)
+        if content is None or not content.startswith(self.DIGEST_PREFIX):
+            return content
+        return self._read(self.SUBTITLE_BLOBS, content[len(self.DIGEST_PREFIX):].decode('ascii'))
 
-    def read_cached_subtitles(self, sub_id):
-        return self._read_binary_file(self.subtitles_cache_file(sub_id))
+    def read_cached_subtitles(self, sub_id, sub_hash: Optional[str] = None):
+        """
+        :param sub_hash: The server's SubHash (MD5 of the subtitles file). If a subtitles file with the same content
+                         was cached (under any id), it is returned.
+        """
+        with self.stats.timer(f"{self.SUBTITLES}.lookup"):
+            content = self._read_subtitles(str(sub_id), sub_hash)
+        self.stats.count(f"{self.SUBTITLES}.{'misses' if content is None else 'hits'}")
+        return content
 
     def write_cached_subtitles(self, sub_id, content: bytes):
-        self._write_binary_file(self.subtitles_cache_file(sub_id), content)
+        digest = self.subtitles_digest(content)
+        if self._read(self.SUBTITLE_BLOBS, digest) is None:
+            self._write(self.SUBTITLE_BLOBS, digest, content)
+        self._write(self.SUBTITLES, str(sub_id), self.DIGEST_PREFIX + digest.encode('ascii'))
 
-    def clear_cache(self):
-        current_time = datetime.now()
+    def clear_cache(self, force=False):
+        """
+        Delete the expired entries, and then the least recently accessed entries of namespaces over their budget.
+        Runs at most once every EVICTION_INTERVAL_SECONDS (unless forced).
+        """
+        current_time = time.time()
+        with self._eviction_lock:
+            if not force and current_time < self._next_eviction:
+                return
+            self._next_eviction = current_time + EVICTION_INTERVAL_SECONDS
 
-        for root, _, files in os.walk(self.cache_path):
+        with self._storage.eviction_lock() as acquired:
+            if not acquired:
+                # Another process is evicting
+                return
+            with self.stats.timer("eviction"):
+                for namespace in self.NAMESPACES:
+                    policy = self.policies[namespace]
+                    evicted = self._storage.evict(namespace, current_time - policy.retention_seconds)
+                    evicted += self._storage.evict_lru(namespace, policy.max_bytes, policy.max_entries)
+                    self.stats.count(f"{namespace}.evictions", evicted)
 
-            for f in files:
-                path = os.path.join(root, f)
-                modified = datetime.fromtimestamp(os.path.getmtime(path))
-                days = (current_time - modified).total_seconds() / SECONDS_PER_DAY
-                if days > CACHE_LIFETIME_DAYS:
-                    self.logger.info("Delete: %s", f)
-                    os.unlink(path)
+    def close(self):
+        self._storage.close()
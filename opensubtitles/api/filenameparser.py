@@ -1,5 +1,11 @@
+import functools
 import os
 import re
+import string
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional, Sequence
 
 QUALITY_OPTIONS = [
     "480p",
@@ -234,9 +240,13 @@ def make_term_regexp(term: str):
     return term
 
 
-def make_or_terms_regexp(term_list: list[str]):
+def sorted_terms(term_list: list[str]) -> list[str]:
     # Make sure we match longest terms first.
-    term_list = sorted(set(term_list), key=len, reverse=True)
+    return sorted(set(term_list), key=len, reverse=True)
+
+
+def make_or_terms_regexp(term_list: list[str]):
+    term_list = sorted_terms(term_list)
     terms_re = "|".join(map(make_term_regexp, term_list))
     return f"({terms_re})"
 
@@ -266,10 +276,24 @@ SEARCHES = {
 }
 
 COLUMNS = "title", *SEARCHES.keys(), "group", "search-term"
+# Should be incremented whenever the parser output changes (invalidates cached parsed results)
+PARSER_VERSION = 2
+# The number of (distinct) file names whose properties are kept by parse_filename()
+PARSE_CACHE_SIZE = 8192
+
+# Read-only properties: the lists are tuples
+FileProperties = Mapping[str, str | tuple[str, ...]]
+# The columns of parse_filenames()
+BATCH_COLUMNS = *COLUMNS, "season", "episode"
+# parse_filenames() only starts a process pool for at least this many (distinct) file names
+PARALLEL_PARSE_MIN_NAMES = 20000
 ID_COLUMNS = "title", "year", "season-episode"
 
 
-def parse_filename(movie_file_path: str) -> dict[str, str | list[str]]:
+def parse_filename_regex(movie_file_path: str) -> dict[str, str | list[str]]:
+    """
+    Reference implementation of parse_filename_tokens(), that runs each of the SEARCHES regexps over the file name.
+    """
     file_name = os.path.basename(movie_file_path)
 
     properties: dict[str, str | list[str]] = {}
@@ -300,10 +324,300 @@ def parse_filename(movie_file_path: str) -> dict[str, str | list[str]]:
 
             properties.setdefault(k, []).append(value)
 
+    return finalize_properties(file_name, properties, s, e, container_start)
+
+
+# Tokens are the runs of alphanumerics in a folded file name (see fold_name()).
+# Each term is matched from the start of a token, and the separators within a term are optional.
+TOKEN = re.compile(r"[a-z0-9]+")
+ALNUM = string.ascii_lowercase + string.digits
+ALNUM_SET = frozenset(ALNUM)
+TERM_TABLES = {
+    "video-quality": QUALITY_OPTIONS,
+    "release-format": RELEASE_FORMATS,
+    "video-label": VIDEO_LABELS,
+    "audio-label": AUDIO_LABELS,
+    "tv-term": TV_TERMS,
+}
+VIDEO_CONTAINERS_SET = frozenset(VIDEO_CONTAINERS)
+
+
+@functools.lru_cache(maxsize=4096)
+def fold_char(c: str) -> str:
+    """
+    :return: the lower case ASCII alphanumeric that the case-insensitive regexps match to the char
+             (e.g., the Kelvin sign matches "k"), or the char itself (a separator)
+    """
+    return next((a for a in ALNUM if re.fullmatch(a, c, re.IGNORECASE)), c)
+
+
+def fold_name(file_name: str) -> str:
+    """ :return: the file name in lower case, keeping the position of each char """
+    if file_name.isascii():
+        return file_name.lower()
+    return "".join(c.lower() if c.isascii() else fold_char(c) for c in file_name)
+
+
+class TermNode:
+    __slots__ = "children", "sep", "next", "terminals", "trailing", "audio_label"
+
+    def __init__(self):
+        self.children: dict[str, TermNode] = {}
+        # Followed by a separator (or more)
+        self.sep: Optional[TermNode] = None
+        # Char -> the nodes that follow it (a child, or a child of the separator node, as the separators are optional)
+        self.next: dict[str, tuple[TermNode, ...]] = {}
+        # Category -> priority of the terms that end in this node (the lower, the preferred)
+        self.terminals: dict[str, int] = {}
+        # Same, for terms that end with a separator
+        self.trailing: dict[str, int] = {}
+        # Priority of the audio label that ends in this node (it may end in the middle of a token)
+        self.audio_label: Optional[int] = None
+
+    def link(self):
+        self.next = {c: (child,) for c, child in self.children.items()}
+        if self.sep is not None:
+            for c, child in self.sep.children.items():
+                self.next[c] = self.next.get(c, ()) + (child,)
+            self.sep.link()
+        for child in self.children.values():
+            child.link()
+
+
+def make_terms_trie(term_tables: dict[str, list[str]]) -> TermNode:
+    """
+    Trie of the terms of all the categories. A term is preferred over the other terms of its category,
+    in the same order as its regexp alternation (see make_or_terms_regexp()).
+    """
+    root = TermNode()
+    for category, term_list in term_tables.items():
+        for priority, term in enumerate(sorted_terms(term_list)):
+            node = root
+            parts = SEP.split(term.lower())
+            for i, part in enumerate(parts):
+                if i > 0 and not part:
+                    node.trailing.setdefault(category, priority)
+                    break
+                if i > 0:
+                    if node.sep is None:
+                        node.sep = TermNode()
+                    node = node.sep
+                for c in part:
+                    node = node.children.setdefault(c, TermNode())
+            else:
+                if category == "audio-label":
+                    if node.audio_label is None:
+                        node.audio_label = priority
+                else:
+                    node.terminals.setdefault(category, priority)
+    root.link()
+    return root
+
+
+TERMS_TRIE = make_terms_trie(TERM_TABLES)
+# A term can only match from a token that is a prefix of the term (without its separators), unless it
+# ends in the middle of the token (an audio label that is followed by the audio quality).
+TERMS_PREFIXES = frozenset(
+    joined[:i] for term_list in TERM_TABLES.values() for joined in (SEP.sub("", t).lower() for t in term_list)
+    for i in range(1, len(joined) + 1)
+)
+AUDIO_LABELS_PREFIXES = tuple(SEP.sub("", t).lower() for t in AUDIO_LABELS)
+
+
+class FileNameTokens:
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        self.folded = fold_name(file_name)
+        self.size = len(file_name)
+        self.spans = [m.span() for m in TOKEN.finditer(self.folded)]
+        # The end of each token -> the end of the separators that follow it
+        self.sep_ends = {end: next_start for (_, end), (next_start, _) in zip(self.spans, self.spans[1:])}
+        if self.spans and self.spans[-1][1] < self.size:
+            self.sep_ends[self.spans[-1][1]] = self.size
+
+    def is_boundary(self, i: int) -> bool:
+        return i >= self.size or self.folded[i] not in ALNUM_SET
+
+    def is_digit(self, i: int) -> bool:
+        return i < self.size and self.file_name[i].isdecimal()
+
+    def match_year(self, i: int) -> Optional[int]:
+        if (self.file_name.startswith(("19", "20"), i) and self.is_digit(i + 2) and self.is_digit(i + 3)
+                and self.is_boundary(i + 4)):
+            return i + 4
+        return None
+
+    def match_season_episode(self, i: int) -> Optional[int]:
+        if self.folded[i] != "s" or not self.is_digit(i + 1) or not self.is_digit(i + 2):
+            return None
+        if (i + 3 < self.size and self.folded[i + 3] == "e" and self.is_digit(i + 4) and self.is_digit(i + 5)
+                and self.is_boundary(i + 6)):
+            return i + 6
+        if self.is_boundary(i + 3):
+            return i + 3
+        return None
+
+    def match_audio_quality(self, i: int) -> Optional[int]:
+        """ Matches "5.1", "7.1", "6CH", etc. (also in the middle of a token) """
+        if i + 3 > self.size or self.folded[i] not in "567":
+            return None
+        if self.folded[i + 1:i + 3] in (".1", "ch") and self.is_boundary(i + 3):
+            return i + 3
+        return None
+
+    def match_audio_label_suffix(self, i: int) -> Optional[int]:
+        """ The audio label is either followed by the audio quality (with optional separators), or by a boundary """
+        end = self.match_audio_quality(self.sep_ends.get(i, i))
+        if end is not None:
+            return end
+        if self.is_boundary(i):
+            return i
+        return None
+
+    def match_container(self) -> Optional[tuple[int, int]]:
+        """ :return: the span of the (case-sensitive) container extension at the end of the file name """
+        body = self.file_name
+        if body.endswith("\n"):
+            # As the regexp "$"
+            body = body[:-1]
+        start = body.rfind(".")
+        if start >= 0 and body[start + 1:] in VIDEO_CONTAINERS_SET:
+            return start, len(body)
+        return None
+
+    def match_terms(self, start: int) -> dict[str, tuple[int, int]]:
+        """
+        Walks the terms trie from the start position, following all the terms that match the name.
+        :return: category -> (priority, end) of the preferred matching term of each category
+        """
+        matches: dict[str, tuple[int, int]] = {}
+        folded, size, sep_ends = self.folded, self.size, self.sep_ends
+        nodes: tuple[TermNode, ...] = (TERMS_TRIE,)
+        i = start
+        while nodes:
+            boundary = i >= size or i in sep_ends
+            for node in nodes:
+                if node.audio_label is not None:
+                    end = self.match_audio_label_suffix(i)
+                    best = matches.get("audio-label", None)
+                    if end is not None and (best is None or node.audio_label < best[0]):
+                        matches["audio-label"] = node.audio_label, end
+                if not boundary:
+                    continue
+                for category, priority in node.terminals.items():
+                    if category not in matches or priority < matches[category][0]:
+                        matches[category] = priority, i
+                if node.trailing:
+                    # All the trailing separators, but the one before the next token (if any)
+                    sep_end = sep_ends.get(i, i)
+                    end = sep_end if sep_end >= size else sep_end - 1
+                    for category, priority in node.trailing.items():
+                        if category not in matches or priority < matches[category][0]:
+                            matches[category] = priority, end
+
+            if not boundary:
+                c = folded[i]
+                if len(nodes) == 1:
+                    nodes = nodes[0].next.get(c, ())
+                else:
+                    nodes = tuple(n for node in nodes for n in node.next.get(c, ()))
+                i += 1
+            elif i < size:
+                nodes = tuple(node.sep for node in nodes if node.sep is not None)
+                i = sep_ends[i]
+            else:
+                break
+        return matches
+
+
+def select_matches(candidates: list[tuple[int, int]], start: int = 0) -> list[tuple[int, int]]:
+    """ :return: the non-overlapping (start, end) matches, scanning from left to right (as re.finditer()) """
+    selected = []
+    for s, e in candidates:
+        if s >= start:
+            selected.append((s, e))
+            start = e
+    return selected
+
+
+def parse_filename_tokens(movie_file_path: str) -> dict[str, str | list[str]]:
+    """
+    Single pass over the tokens of the file name, that matches all the SEARCHES at once.
+    The output is identical to parse_filename_regex().
+    """
+    file_name = os.path.basename(movie_file_path)
+    tokens = FileNameTokens(file_name)
+
+    folded = tokens.folded
+    candidates: dict[str, list[tuple[int, int]]] = defaultdict(list)
+    for token_start, token_end in tokens.spans:
+        first = folded[token_start]
+        if first == "1" or first == "2":
+            end = tokens.match_year(token_start)
+            if end is not None:
+                candidates["year"].append((token_start, end))
+        elif first == "s":
+            end = tokens.match_season_episode(token_start)
+            if end is not None:
+                candidates["season-episode"].append((token_start, end))
+
+        if folded[token_start:token_end] in TERMS_PREFIXES or folded.startswith(AUDIO_LABELS_PREFIXES, token_start):
+            for k, (_, end) in tokens.match_terms(token_start).items():
+                candidates[k].append((token_start, end))
+
+        # The audio quality ends a token ("6CH"), or is a "5" token followed by ".1"
+        last = folded[token_end - 1]
+        if last == "h" or last in "567":
+            i = token_end - 1 if last != "h" else token_end - 3
+            end = tokens.match_audio_quality(i) if i >= token_start else None
+            if end is not None:
+                candidates["audio-quality"].append((i, end))
+
+    container = tokens.match_container()
+    if container is not None:
+        candidates["video-container"].append(container)
+
+    tv_candidates = candidates.pop("tv-term", [])
+    matches = {k: select_matches(v) for k, v in candidates.items()}
+    # The matches are ordered by their start
+    s = min((v[0][0] for v in matches.values()), default=tokens.size)
+
+    # The TV term might collide with the actual title, so it is only matched after the other properties.
+    if 0 < s < tokens.size and not tokens.is_boundary(s) and not tokens.is_boundary(s - 1):
+        # The first property starts in the middle of a token (audio quality)
+        tv_match = tokens.match_terms(s).get("tv-term", None)
+        if tv_match is not None:
+            tv_candidates.insert(0, (s, tv_match[1]))
+    if tv_candidates:
+        matches["tv-term"] = select_matches(tv_candidates, s)
+
+    # The matches of each category do not overlap, so the last one ends last
+    s = min((v[0][0] for v in matches.values() if v), default=tokens.size)
+    e = max((v[-1][1] for k, v in matches.items() if v and k != "video-container"), default=0)
+    container_start = container[0] if container is not None else tokens.size
+
+    properties: dict[str, str | list[str]] = {}
+    for k in SEARCHES:
+        for m_start, m_end in matches.get(k, ()):
+            value = file_name[m_start:m_end]
+            if k == "season-episode":
+                value = value.upper()
+                properties.setdefault("season", []).append(file_name[m_start + 1:m_start + 3])
+                if m_end - m_start == 6:
+                    properties.setdefault("episode", []).append(file_name[m_start + 4:m_start + 6])
+
+            properties.setdefault(k, []).append(value)
+
+    return finalize_properties(file_name, properties, s, e, container_start)
+
+
+def finalize_properties(file_name: str, properties: dict[str, str | list[str]], s: int, e: int,
+                        container_start: int) -> dict[str, str | list[str]]:
     # Anything that remains before the video container is the group.
     properties["group"] = [SEP.sub(" ", file_name[e:container_start]).strip()]
 
-    properties = {k: list(set(v)) for k, v in properties.items()}
+    # Unique values, in the order of their matches (a set order would change the search term between runs)
+    properties = {k: list(dict.fromkeys(v)) for k, v in properties.items()}
 
     # The beginning of the filename, before any property, is the title.
     properties["title"] = SEP.sub(" ", file_name[:s]).strip().title()
@@ -318,6 +632,67 @@ def parse_filename(movie_file_path: str) -> dict[str, str | list[str]]:
     return properties
 
 
+def freeze_properties(properties: Mapping[str, str | list[str] | tuple[str, ...]]) -> FileProperties:
+    return MappingProxyType({k: tuple(v) if isinstance(v, list) else v for k, v in properties.items()})
+
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _parse_file_name(file_name: str) -> FileProperties:
+    return freeze_properties(parse_filename_tokens(file_name))
+
+
+def parse_filename(movie_file_path: str) -> FileProperties:
+    """
+    Memoized by the file name, so the result is read-only (see freeze_properties()).
+    """
+    return _parse_file_name(os.path.basename(movie_file_path))
+
+
+def parse_filename_cache_info():
+    """ :return: the hits, misses and size of the parse_filename() memoization """
+    return _parse_file_name.cache_info()
+
+
+def _parse_columns(file_names: Sequence[str]) -> dict[str, list[str | tuple[str, ...] | None]]:
+    columns = {k: [None] * len(file_names) for k in BATCH_COLUMNS}
+    for i, file_name in enumerate(file_names):
+        # Only the found properties are set
+        for k, v in parse_filename_tokens(file_name).items():
+            columns[k][i] = tuple(v) if type(v) is list else v
+    return columns
+
+
+def parse_filenames(movie_file_paths: Iterable[str],
+                    processes: int = 1) -> dict[str, list[str | tuple[str, ...] | None]]:
+    """
+    Parses many file names at once. Each distinct file name is parsed once (unlike parse_filename(),
+    the batch does not go through the memoization, so it does not evict the recently parsed names).
+    :param movie_file_paths: An iterable of movie (or subtitles) file paths
+    :param processes: The number of parsing processes, used for at least PARALLEL_PARSE_MIN_NAMES distinct names
+    :return: column -> the value of each file name (in the input order), for each of the BATCH_COLUMNS.
+             Missing properties are None, and the lists are tuples (as in parse_filename()).
+    """
+    # Distinct file name -> its index in the parsed columns
+    distinct: dict[str, int] = {}
+    indices = [distinct.setdefault(os.path.basename(path), len(distinct)) for path in movie_file_paths]
+    file_names = list(distinct)
+
+    if processes > 1 and len(file_names) >= PARALLEL_PARSE_MIN_NAMES:
+        chunk_size = -(-len(file_names) // (4 * processes))
+        chunks = [file_names[i:i + chunk_size] for i in range(0, len(file_names), chunk_size)]
+        columns = {k: [] for k in BATCH_COLUMNS}
+        with ProcessPoolExecutor(processes) as pool:
+            for chunk_columns in pool.map(_parse_columns, chunks):
+                for k, column in columns.items():
+                    column.extend(chunk_columns[k])
+    else:
+        columns = _parse_columns(file_names)
+
+    if len(file_names) == len(indices):
+        return columns
+    return {k: [column[i] for i in indices] for k, column in columns.items()}
+
+
 def _get_unified_key(p, key):
     v = p.get(key, None)
     if isinstance(v, (list, tuple)):
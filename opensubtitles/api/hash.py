@@ -1,27 +1,52 @@
 import hashlib
 import os
 import struct
-from typing import Dict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 block_size = 2 ** 16
 min_file_size = block_size * 2
-longlong_format = '<q'  # little-endian long long
-longlong_size = struct.calcsize(longlong_format)
-longlong_per_block = int(block_size / longlong_size)
 block_mask = 0xFFFFFFFFFFFFFFFF  # to remain as 64bit number
+block_format = '<%dq' % (block_size // struct.calcsize('<q'))  # a whole block of little-endian long longs
+default_hash_workers = 8
+# Gio.FILE_ATTRIBUTE_STANDARD_SIZE and GLib.SeekType.SET (GIO files are duck-typed, without importing gi)
+gio_size_attribute = 'standard::size'
+gio_seek_set = 1
+
+
+def sum_block(buf: bytes) -> int:
+    """
+    Sum a whole block of little-endian 64bit words (modulo 2^64).
+    Uses NumPy when available (unsigned 64bit sum wraps around), and struct otherwise.
+    """
+    if numpy is not None:
+        return int(numpy.frombuffer(buf, dtype='<u8').sum(dtype=numpy.uint64))
+    return sum(struct.unpack(block_format, buf)) & block_mask
 
 
-def read_longlong(file_handle):
-    buf = file_handle.read(longlong_size)
-    (l_value,) = struct.unpack(longlong_format, buf)
-    return l_value
+def hash_blocks(file_size: int, read_block: Callable[[int], bytes]) -> str:
+    """
+    Hash the first and the last blocks of a movie, given its size and a function that reads a block at an offset.
+    :return: the movie hash
+    """
+    if file_size < min_file_size:
+        raise Exception("Hash: file must be larger than two blocks (%s)" % min_file_size)
+
+    file_hash = file_size
+    last_block = max(0, file_size - block_size)
 
+    for hash_place in [0, last_block]:
+        buf = read_block(hash_place)
+        if len(buf) != block_size:
+            raise Exception("Hash: Failed to read a full block at %s (%s bytes)" % (hash_place, len(buf)))
+        file_hash = (file_hash + sum_block(buf)) & block_mask
 
-def hash_block(file_handle, current_hash):
-    for _ in range(longlong_per_block):
-        current_hash += read_longlong(file_handle)
-        current_hash &= block_mask
-    return current_hash
+    return "%016x" % file_hash
 
 
 def hash_file(file_path):
@@ -33,24 +58,112 @@ def hash_file(file_path):
     """
     file_size = os.path.getsize(file_path)
 
-    if file_size < min_file_size:
-        raise Exception("Hash: file must be larger than two blocks (%s)" % min_file_size)
+    if not hasattr(os, 'pread'):
+        with open(file_path, "rb") as f:
+            def read_block(offset):
+                f.seek(offset, os.SEEK_SET)
+                if f.tell() != offset:
+                    raise Exception("Hash: Failed to seek to %s" % offset)
+                return f.read(block_size)
+
+            return hash_blocks(file_size, read_block), file_size
+
+    # Positional reads skip the buffered reader and the seeks
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        return hash_blocks(file_size, lambda offset: os.pread(fd, block_size, offset)), file_size
+    finally:
+        os.close(fd)
 
-    file_hash = file_size
-    last_block = max(0, file_size - block_size)
 
-    with open(file_path, "rb") as f:
-        for hash_place in [0, last_block]:
-            f.seek(hash_place, os.SEEK_SET)
-            if f.tell() != hash_place:
-                raise Exception("Hash: Failed to seek to %s" % hash_place)
-            file_hash = hash_block(f, file_hash)
+def hash_gio_file(movie_file) -> Tuple[str, int]:
+    """
+    Hash a movie via GIO, so non-local files (smb://, sftp://, nfs://) are hashed
+    with range reads of the first and last blocks rather than copied locally.
+    :param movie_file: A Gio.File
+    :return: tuple (hash, size)
+    """
+    info = movie_file.query_info(gio_size_attribute, 0, None)  # Gio.FileQueryInfoFlags.NONE
+    file_size = info.get_size()
+
+    stream = movie_file.read(None)
+    try:
+        if not stream.can_seek():
+            raise Exception("Hash: stream is not seekable")
+
+        def read_block(offset):
+            stream.seek(offset, gio_seek_set, None)
+            chunks = []
+            remaining = block_size
+            while remaining > 0:
+                chunk = stream.read_bytes(remaining, None).get_data()
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                remaining -= len(chunk)
+            return b''.join(chunks)
+
+        return hash_blocks(file_size, read_block), file_size
+    finally:
+        stream.close(None)
+
+
+class HashResult(NamedTuple):
+    path: str
+    hash: Optional[str]
+    size: Optional[int]
+    error: Optional[Exception] = None
+
 
-    returned_hash = "%016x" % file_hash
-    return returned_hash, file_size
+def _hash_file_result(file_path) -> HashResult:
+    try:
+        movie_hash, movie_size = hash_file(file_path)
+        return HashResult(file_path, movie_hash, movie_size)
+    except Exception as e:
+        return HashResult(file_path, None, None, e)
+
+
+def hash_files(file_paths: Iterable[str], max_workers: int = default_hash_workers) -> Iterator[HashResult]:
+    """
+    Hash many movie files concurrently (the work is mostly I/O bound seeks).
+    Results are streamed in completion order, and per-file errors are returned in the result's error field.
+    At most 2 * max_workers paths are consumed ahead of the returned results.
+    :param file_paths: An iterable of movie files paths
+    :param max_workers: The number of hashing threads
+    :return: iterator of HashResult (path, hash, size, error)
+    """
+    max_workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers, thread_name_prefix="opensubtitles-hash") as pool:
+        pending = set()
+        for file_path in file_paths:
+            pending.add(pool.submit(_hash_file_result, file_path))
+            if len(pending) >= 2 * max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def canonical_query(query_data: Dict[str, str]) -> Dict[str, str]:
+    """
+    :return: the query data in a canonical form, so equivalent queries have the same hash:
+             sorted languages, and lower case title and movie hash with collapsed whitespaces
+    """
+    query_data = dict(query_data)
+    if query_data.get('sublanguageid', None):
+        query_data['sublanguageid'] = ",".join(sorted(set(query_data['sublanguageid'].split(","))))
+    for k in ('query', 'moviehash'):
+        if query_data.get(k, None):
+            query_data[k] = " ".join(query_data[k].split()).lower()
+    return query_data
 
 
 def hash_query(query_data: Dict[str, str]):
+    query_data = canonical_query(query_data)
     m = hashlib.sha256()
     for k in sorted(query_data):
         m.update(k.encode('utf8'))
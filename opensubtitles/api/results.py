@@ -1,88 +1,137 @@
+import heapq
 import os
 import pprint
+import sys
+import threading
 from collections import defaultdict
-from typing import Dict, Iterable, List, Optional, TYPE_CHECKING
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, TYPE_CHECKING
 
 import tabulate
 
-from opensubtitles.api.filenameparser import parse_filename
+from opensubtitles.api.filenameparser import FileProperties, freeze_properties, parse_filename
 from opensubtitles.api.hash import hash_query
 from opensubtitles.api.lang import iter_normalize_languages, Languages, LANGUAGES_3_TO_NATURAL
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 if TYPE_CHECKING:
     from opensubtitles.api import OpenSubtitlesApi
 
 SUPPORTED_SUBTITLES_EXT = {"asc", "sub", "srt", "smi", "ssa", "ass"}
+# Should be incremented whenever the scoring or the order of the results changes (invalidates cached rankings)
+SCORING_VERSION = 1
+# Results that do not have the same properties as the query are filtered out
+MATCHED_PROPERTIES = "title", "season-episode"
+# The score of each property value that is shared with the query (in the order they are summed)
+PROPERTY_WEIGHTS = {"release-format": 10, "group": 10, "tv-term": 100}
+# Responses with fewer results are ranked without numpy (the array conversions are slower than sorting)
+NUMPY_RANK_MIN_RESULTS = 256
+# The number of top results that are ranked first when iterating the results (the rest are ranked at once)
+RANK_ITER_STEP = 16
+# Response fields with few distinct values, that are interned (shared by all the rows)
+INTERNED_FIELDS = 'SubLanguageID', 'SubFormat'
+# The shard (cached language) of a query without languages, whose response has the results of all the languages
+ALL_LANGUAGES = ""
+
+
+def normalize_property(value: str) -> str:
+    return value.replace("-. ", "").lower()
+
+
+def intern_fields(data: List[Dict[str, str]]):
+    intern = sys.intern
+    for k in INTERNED_FIELDS:
+        for row in data:
+            v = row.get(k, None)
+            if v.__class__ is str:
+                row[k] = intern(v)
+
+
+def rank_scores(scores: Sequence[float], language_ranks: Sequence[int]) -> List[int]:
+    """
+    :return: the indices of the non-negative scores, ordered by the language rank and then by the descending score
+             (the order of the indices is kept for equal keys)
+    """
+    if numpy is not None and len(scores) >= NUMPY_RANK_MIN_RESULTS:
+        scores = numpy.asarray(scores, dtype=float)
+        indices = numpy.flatnonzero(scores >= 0)
+        # lexsort is stable, and sorts by the last key first
+        order = numpy.lexsort((-scores[indices], numpy.asarray(language_ranks)[indices]))
+        return indices[order].tolist()
+
+    return sorted((i for i, score in enumerate(scores) if score >= 0), key=lambda i: (language_ranks[i], -scores[i]))
 
 
 class Subtitles:
-    DEFAULT_HEADERS = ("id", "language", "file name", "format", "rating", "size")
+    __slots__ = "owner", "query", "data", "properties", "_content"
 
-    def __init__(self, owner: 'OpenSubtitlesApi', query: 'Query', data: Dict[str, str]):
+    DEFAULT_HEADERS = ("id", "language", "file name", "format", "rating", "size")
+    # The helper fields, and the response data field that each is derived from (see get())
+    HELPER_FIELDS = {
+        "id-sub-file": 'IDSubtitleFile',
+        "id-sub": 'IDSubtitle',
+        "id": 'IDSubtitle',
+        "language": 'SubLanguageID',
+        "ext": 'SubFormat',
+        "format": 'SubFormat',
+        "file name": 'SubFileName',
+        "rating": 'SubRating',
+        "size": 'SubSize',
+    }
+
+    def __init__(self, owner: 'OpenSubtitlesApi', query: 'Query', data: Dict[str, str],
+                 properties: Optional[FileProperties] = None):
         self.owner = owner
         self.query = query
         self.data = data
-        self.properties = parse_filename(data['SubFileName'])
-        self.helper_data = {
-            "id-sub-file": data['IDSubtitleFile'],
-            "id-sub": data['IDSubtitle'],
-            "id": data['IDSubtitle'],
-            "language": LANGUAGES_3_TO_NATURAL[data['SubLanguageID']],
-            "ext": data['SubFormat'],
-            "format": data['SubFormat'],
-            "file name": data['SubFileName'],
-            "rating": data['SubRating'],
-            "size": f"{int(data['SubSize']) / 1024:.2f} KB",
-        }
+        if properties is None:
+            properties = parse_filename(data['SubFileName'])
+        self.properties = properties
 
         self._content: Optional[bytes] = None
 
+    @property
+    def helper_data(self) -> Dict[str, str]:
+        """ :return: the helper fields (derived on each access) """
+        return {k: self.get(k) for k in self.HELPER_FIELDS}
+
     def __getitem__(self, item):
         if isinstance(item, (list, tuple)):
             return [self.get(k) for k in item]
         return self.get(item)
 
     def items(self):
-        d = dict(self.data)
-        d.update(self.helper_data)
         return self.helper_data.items()
 
     def get(self, item):
-        if item in self.helper_data:
-            return self.helper_data[item]
-        return self.data[item]
+        field = self.HELPER_FIELDS.get(item, None)
+        if field is None:
+            return self.data[item]
+        value = self.data[field]
+        if item == "language":
+            return LANGUAGES_3_TO_NATURAL[value]
+        if item == "size":
+            return f"{int(value) / 1024:.2f} KB"
+        return value
 
     @property
     def id(self):
-        return self.helper_data['id-sub']
+        return self.data['IDSubtitle']
 
     @property
     def ext(self):
-        return self.helper_data['ext']
+        return self.data['SubFormat']
 
     @property
-    def score(self) -> float:
-        if self.helper_data['ext'] not in SUPPORTED_SUBTITLES_EXT:
-            return -1
+    def sub_hash(self) -> Optional[str]:
+        return self.data.get('SubHash', None)
 
-        for k in ("title", "season-episode"):
-            if self.properties.get(k, None) != self.query.properties.get(k, None):
-                return -1
-
-        score = float(self.get("rating"))
-
-        def get_property(p: dict, key: str) -> set:
-            return set([v.replace("-. ", "").lower() for v in p.get(key, [])])
-
-        def match_properties(key: str):
-            my_prop = get_property(self.properties, key)
-            query_prop = get_property(self.query.properties, key)
-            return len(my_prop.intersection(query_prop))
-
-        score += 10 * match_properties("release-format")
-        score += 10 * match_properties("group")
-        score += 100 * match_properties("tv-term")
-        return score
+    @property
+    def score(self) -> float:
+        return self.query.score(self.data, self.properties)
 
     def summary(self, headers=None):
         if headers is None:
@@ -96,7 +145,7 @@ class Subtitles:
     @property
     def content(self):
         if not self.has_content:
-            self._content = self.owner.download_subtitles(self.id)
+            self._content = self.owner.download_subtitles(self.id, sub_hash=self.sub_hash)
         return self._content
 
     def __repr__(self):
@@ -115,25 +164,239 @@ class Subtitles:
             f.write(content)
 
 
+class RankedResults(Sequence[Subtitles]):
+    """
+    The results of a response, ranked and created lazily. The rows of each language are only parsed and scored
+    when the results reach that language (in the order of the query languages), the top rows are popped from
+    a heap as they are accessed, and their Subtitles are created on their first access.
+    The length requires the whole ranking.
+    """
+    __slots__ = "query", "data", "_properties", "_subtitles", "_lock", "_ranking", "_heap", "_pending", "_on_ranked"
+
+    def __init__(self, query: 'Query', data: List[Dict[str, str]],
+                 data_properties: Optional[List[FileProperties]] = None, ranking: Optional[Sequence[int]] = None):
+        self.query = query
+        self.data = data
+        # The parsed properties of each row (parsed on demand)
+        self._properties: List[Optional[FileProperties]] = (
+            list(data_properties) if data_properties is not None else [None] * len(data)
+        )
+        self._subtitles: Dict[int, Subtitles] = {}
+        self._lock = threading.RLock()
+        # The ranked rows so far, the (-score, index) heap of the current language rows,
+        # and the rows of each of the next languages (the last is the next one). None until the ranking starts.
+        self._ranking: List[int] = list(ranking) if ranking is not None else []
+        self._heap: List[Tuple[float, int]] = []
+        self._pending: Optional[List[List[int]]] = [] if ranking is not None else None
+        # Called once all the rows are ranked
+        self._on_ranked: List[Callable[[], None]] = []
+
+    def _language_ranks(self) -> List[int]:
+        # The other languages are last
+        lang_order = {l: i for i, l in enumerate(self.query.languages)}
+        return [lang_order.get(r['SubLanguageID'], len(lang_order)) for r in self.data]
+
+    def properties(self, i: int) -> FileProperties:
+        properties = self._properties[i]
+        if properties is None:
+            properties = self._properties[i] = parse_filename(self.data[i]['SubFileName'])
+        return properties
+
+    @property
+    def data_properties(self) -> List[FileProperties]:
+        """ :return: the parsed properties of all the rows """
+        with self._lock:
+            self._properties = [p if p is not None else parse_filename(r['SubFileName'])
+                                for r, p in zip(self.data, self._properties)]
+            return self._properties
+
+    @property
+    def parsed_properties(self) -> List[Optional[FileProperties]]:
+        """ :return: the parsed properties of each row, or None for the rows that were not parsed (yet) """
+        with self._lock:
+            return list(self._properties)
+
+    @property
+    def ranking(self) -> List[int]:
+        """ :return: the ranked indices of all the rows """
+        self._rank()
+        return self._ranking
+
+    @property
+    def is_ranked(self) -> bool:
+        """ :return: whether all the rows are ranked """
+        return self._pending is not None and not self._pending and not self._heap
+
+    def when_ranked(self, callback: Callable[[], None]):
+        """ Call the callback once all the rows are ranked (right away, if they already are) """
+        with self._lock:
+            if not self.is_ranked:
+                self._on_ranked.append(callback)
+                return
+        callback()
+
+    def _score_rows(self, rows: Iterable[int]) -> List[Tuple[float, int]]:
+        query, data, properties = self.query, self.data, self._properties
+        scored = []
+        for i in rows:
+            p = properties[i]
+            if p is None:
+                p = properties[i] = parse_filename(data[i]['SubFileName'])
+            score = query.score(data[i], p)
+            if score >= 0:
+                scored.append((-score, i))
+        return scored
+
+    def _rank(self, n: Optional[int] = None) -> int:
+        """
+        Ranks at least n rows, if there are (or all the rows).
+        :return: the number of ranked rows
+        """
+        with self._lock:
+            if self._pending is None and n is None:
+                # Ranks the whole response at once
+                score = self.query.score
+                scores = [score(r, p) for r, p in zip(self.data, self.data_properties)]
+                self._ranking = rank_scores(scores, self._language_ranks())
+                self._pending = []
+            elif self._pending is None:
+                language_ranks = self._language_ranks()
+                languages_rows: Dict[int, List[int]] = defaultdict(list)
+                for i, r in enumerate(self.data):
+                    # The other formats are never ranked (see Query.score())
+                    if r['SubFormat'] in SUPPORTED_SUBTITLES_EXT:
+                        languages_rows[language_ranks[i]].append(i)
+                self._pending = [languages_rows[k] for k in sorted(languages_rows, reverse=True)]
+
+            while (n is None or len(self._ranking) < n) and (self._heap or self._pending):
+                if not self._heap:
+                    self._heap = self._score_rows(self._pending.pop())
+                    if n is None or n - len(self._ranking) < len(self._heap):
+                        heapq.heapify(self._heap)
+                if n is None or n - len(self._ranking) >= len(self._heap):
+                    self._ranking.extend(i for _, i in sorted(self._heap))
+                    self._heap = []
+                    continue
+                while len(self._ranking) < n:
+                    self._ranking.append(heapq.heappop(self._heap)[1])
+
+            size = len(self._ranking)
+            on_ranked = self._on_ranked if self.is_ranked else []
+            if on_ranked:
+                self._on_ranked = []
+
+        for callback in on_ranked:
+            callback()
+        return size
+
+    def _get(self, position: int) -> Subtitles:
+        with self._lock:
+            subtitles = self._subtitles.get(position, None)
+            if subtitles is None:
+                i = self._ranking[position]
+                subtitles = Subtitles(self.query.owner, self.query, self.data[i], self.properties(i))
+                self._subtitles[position] = subtitles
+            return subtitles
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            if item.stop is not None and item.stop >= 0 and (item.start or 0) >= 0 and (item.step or 1) > 0:
+                # Only the top results are required
+                size = self._rank(item.stop)
+            else:
+                size = len(self)
+            return [self._get(position) for position in range(*item.indices(size))]
+
+        if item < 0:
+            item += len(self)
+        if item < 0 or self._rank(item + 1) <= item:
+            raise IndexError("results index out of range")
+        return self._get(item)
+
+    def __iter__(self) -> Iterator[Subtitles]:
+        position = 0
+        while position < len(self._ranking) or position < self._rank(RANK_ITER_STEP if position == 0 else None):
+            yield self._get(position)
+            position += 1
+
+    def __len__(self):
+        return self._rank()
+
+    def __bool__(self):
+        return self._rank(1) > 0
+
+
 class Query:
+    __slots__ = ("owner", "languages", "movie_file_path", "properties", "_property_bits", "_property_masks",
+                 "query_data", "query_hash", "cached_shards", "missing_languages", "response", "_results", "is_stale")
+
     def __init__(self, owner: 'OpenSubtitlesApi', languages: Languages,
-                 movie_file_path: Optional[str] = None, **kwargs):
+                 movie_file_path: Optional[str] = None, movie_properties: Optional[FileProperties] = None, **kwargs):
+        """
+        :param movie_properties: The parsed movie file path (if it was already parsed).
+        """
         self.owner = owner
         self.languages = list(iter_normalize_languages(languages))
         self.movie_file_path = movie_file_path
-        if movie_file_path is not None:
-            self.properties = parse_filename(movie_file_path)
-        else:
-            self.properties = {}
+        if movie_properties is None and movie_file_path is not None:
+            movie_properties = parse_filename(movie_file_path)
+        self.properties: FileProperties = movie_properties if movie_properties is not None else freeze_properties({})
+        # A bit for each (normalized) value of the scored properties of the query, and the mask of each property
+        self._property_bits: Dict[Tuple[str, str], int] = {}
+        self._property_masks: List[Tuple[int, int]] = []
+        for key, weight in PROPERTY_WEIGHTS.items():
+            mask = 0
+            for value in set(map(normalize_property, self.properties.get(key, ()))):
+                mask |= self._property_bits.setdefault((key, value), 1 << len(self._property_bits))
+            self._property_masks.append((weight, mask))
 
         self.query_data = {
             'sublanguageid': ",".join(self.languages),
             **kwargs,
         }
         self.query_hash = hash_query(self.query_data)
+        # The query of each language is cached separately. These are set by the cache lookup: the cached
+        # response of each found language, and the languages that should be fetched from the server.
+        self.cached_shards: Dict[str, dict] = {}
+        self.missing_languages: List[str] = self.shard_languages
 
         self.response: Optional[Dict[str, object]] = None
-        self.results: Optional[List[Subtitles]] = None
+        self._results: Optional[RankedResults] = None
+        # The response is an expired cached response, that is being refreshed
+        self.is_stale = False
+
+    @property
+    def shard_languages(self) -> List[str]:
+        """ :return: the languages of the cached shards of this query (a query without languages is a single shard) """
+        return list(self.languages) or [ALL_LANGUAGES]
+
+    def shard_hash(self, language: str) -> str:
+        """ :return: the hash of this query, restricted to a single language """
+        return hash_query({**self.query_data, 'sublanguageid': language})
+
+    def score(self, row: Dict[str, str], properties: FileProperties) -> float:
+        """ :return: the score of a response row (negative if it does not match the query) """
+        if row['SubFormat'] not in SUPPORTED_SUBTITLES_EXT:
+            return -1
+
+        query_properties = self.properties
+        for k in MATCHED_PROPERTIES:
+            if properties.get(k, None) != query_properties.get(k, None):
+                return -1
+
+        score = float(row['SubRating'])
+        if not self._property_bits:
+            return score
+
+        # The bits of the values that are shared with the query
+        bits = self._property_bits
+        shared = 0
+        for key in PROPERTY_WEIGHTS:
+            for value in properties.get(key, ()):
+                shared |= bits.get((key, normalize_property(value)), 0)
+        for weight, mask in self._property_masks:
+            score += weight * (shared & mask).bit_count()
+        return score
 
     @property
     def has_response(self):
@@ -141,9 +404,52 @@ class Query:
 
     @property
     def has_results(self):
-        return self.results is not None and len(self.results) > 0
+        return self._results is not None and bool(self._results)
+
+    @property
+    def results(self) -> Optional[List[Subtitles]]:
+        """ :return: all the ranked results (see RankedResults) """
+        if self._results is None:
+            return None
+        return list(self._results)
+
+    @property
+    def data_properties(self) -> Optional[List[FileProperties]]:
+        """ :return: the parsed properties of each row of the response data """
+        if self._results is None:
+            return None
+        return self._results.data_properties
+
+    @property
+    def parsed_properties(self) -> Optional[List[Optional[FileProperties]]]:
+        """ :return: the properties of the response data rows that were parsed so far (None for the others) """
+        if self._results is None:
+            return None
+        return self._results.parsed_properties
 
-    def set_response(self, response):
+    @property
+    def ranking(self) -> Optional[List[int]]:
+        """ :return: the indices of the ranked rows of the response data """
+        if self._results is None:
+            return None
+        return self._results.ranking
+
+    def when_ranked(self, callback: Callable[[], None]) -> bool:
+        """
+        Call the callback once all the results are ranked (e.g., iterated), without ranking them.
+        :return: False if there are no results
+        """
+        if self._results is None:
+            return False
+        self._results.when_ranked(callback)
+        return True
+
+    def set_response(self, response, data_properties: Optional[List[FileProperties]] = None,
+                     ranking: Optional[Sequence[int]] = None):
+        """
+        :param data_properties: The (previously) parsed properties of each row of the response data.
+        :param ranking: The (previously) ranked indices of the response data rows.
+        """
         if not response:
             return False
 
@@ -152,28 +458,24 @@ class Query:
         if not data:
             return False
 
-        lang_order = defaultdict(lambda: float('inf'), **{l: i for i, l in enumerate(self.languages)})
-
-        self.results: List[Subtitles] = sorted(
-            filter(lambda s: s.score >= 0, (Subtitles(self.owner, self, r) for r in data)),
-            key=lambda x: (lang_order[x['SubLanguageID']], -x.score)
-        )
+        intern_fields(data)
+        self._results = RankedResults(self, data, data_properties, ranking)
         return True
 
     def __getitem__(self, item) -> Optional[Subtitles]:
         if not self.has_results:
             return None
-        return self.results[item]
+        return self._results[item]
 
     def __iter__(self) -> Iterable[Subtitles]:
-        if self.results is None:
+        if self._results is None:
             raise ValueError("No result to iterate.")
-        return iter(self.results)
+        return iter(self._results)
 
     def __len__(self):
-        if self.results is None:
+        if self._results is None:
             return 0
-        return len(self.results)
+        return len(self._results)
 
     @property
     def names(self):
@@ -182,7 +484,7 @@ class Query:
     def summary(self, headers=None):
         if not self.has_results:
             return None
-        return [[i, *r.summary(headers)] for i, r in enumerate(self.results)]
+        return [[i, *r.summary(headers)] for i, r in enumerate(self._results)]
 
     def as_table(self, headers=None, table_fmt="simple"):
         if not self.has_results:
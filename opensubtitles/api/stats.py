@@ -0,0 +1,83 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict
+
+# Upper bounds (in milliseconds) of the latency histogram buckets. The last bucket is unbounded.
+LATENCY_BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.
+        self.max_ms = 0.
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def record(self, latency_ms: float):
+        self.count += 1
+        self.total_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)] += 1
+
+    def percentile(self, p: float) -> float:
+        """ :return: the upper bound of the bucket that contains the percentile (bounded by the maximal latency) """
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max_ms)
+        return self.max_ms
+
+    def as_dict(self) -> dict:
+        return {
+            'count': self.count,
+            'mean-ms': self.total_ms / self.count if self.count else 0.,
+            'p50-ms': self.percentile(0.5),
+            'p90-ms': self.percentile(0.9),
+            'p99-ms': self.percentile(0.99),
+            'max-ms': self.max_ms,
+        }
+
+
+class CacheStats:
+    """
+    Thread-safe counters and latency histograms of the cache and the download path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = defaultdict(int)
+        self._latencies: Dict[str, LatencyHistogram] = defaultdict(LatencyHistogram)
+
+    def count(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    def record_latency(self, name: str, latency_ms: float):
+        with self._lock:
+            self._latencies[name].record(latency_ms)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_latency(name, (time.perf_counter() - start) * 1000)
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                'counters': dict(sorted(self._counters.items())),
+                'latency': {k: h.as_dict() for k, h in sorted(self._latencies.items())},
+            }
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._latencies.clear()
+
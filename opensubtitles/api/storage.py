@@ -0,0 +1,416 @@
+import abc
+import contextlib
+import heapq
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import ContextManager, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+CacheEntry = Tuple[bytes, float]  # (content, creation time)
+EntryUsage = Tuple[str, int, float]  # (key, size, last access time)
+
+# The last access time is updated at most once per this period, to avoid a write on every read
+ACCESS_RESOLUTION_SECONDS = 60
+# Other processes may write to the same cache dir, so its index is rebuilt once per this period
+RESCAN_INTERVAL_SECONDS = 6 * 60 * 60
+# Temporary files are created private, but the cached entries are readable by all
+ENTRY_FILE_MODE = 0o644
+# A temporary file that was not renamed into place within this period is left by a writer that was killed
+TEMPORARY_FILE_GRACE_SECONDS = 10 * 60
+
+
+class CacheStorage(abc.ABC):
+    """
+    Storage backend of the cache.
+    Stores binary entries by namespace and key, along with their creation time.
+    """
+
+    @abc.abstractmethod
+    def read(self, namespace: str, key: str) -> Optional[CacheEntry]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def write(self, namespace: str, key: str, content: bytes, created: Optional[float] = None):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def keys(self, namespace: str) -> Iterator[str]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def usage(self, namespace: str) -> List[EntryUsage]:
+        raise NotImplementedError()
+
+    @abc.abstractmethod
+    def evict(self, namespace: str, created_before: float) -> int:
+        """
+        Delete the entries of the namespace that were created before the given time.
+        :return: the number of deleted entries
+        """
+        raise NotImplementedError()
+
+    @contextlib.contextmanager
+    def eviction_lock(self) -> ContextManager[bool]:
+        """
+        Exclusive lock for eviction, among all the processes that share the storage.
+        :return: a context that yields whether the lock was acquired (otherwise, another process is evicting)
+        """
+        yield True
+
+    def evict_lru(self, namespace: str, max_bytes: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+        """
+        Delete the least recently accessed entries of the namespace until it is within the given budget.
+        :return: the number of deleted entries
+        """
+        if max_bytes is None and max_entries is None:
+            return 0
+
+        entries = self.usage(namespace)
+        total_bytes = sum(size for _, size, _ in entries)
+        total_entries = len(entries)
+
+        def within_budget():
+            return ((max_bytes is None or total_bytes <= max_bytes) and
+                    (max_entries is None or total_entries <= max_entries))
+
+        deleted = 0
+        for key, size, _ in sorted(entries, key=lambda e: e[2]):
+            if within_budget():
+                break
+            self.delete(namespace, key)
+            total_bytes -= size
+            total_entries -= 1
+            deleted += 1
+        return deleted
+
+    def close(self):
+        pass
+
+
+class FileSystemStorage(CacheStorage):
+    """
+    Stores each entry as a file: <cache_dir>/<namespace>/<key>.
+    The file's modified time is the entry's creation time, and its access time is explicitly set on reads.
+
+    Safe to share between processes: entries are written to a temporary file which is then renamed into place,
+    so readers (that take no locks) never see a partial entry, and eviction is serialized with an advisory lock.
+    The temporary files of writers that were killed are deleted by the eviction, once they are stale.
+
+    A read-only storage (e.g., a cache dir that is shared by many hosts) is never modified, including the
+    access time of its entries.
+    """
+
+    def __init__(self, cache_dir: str, read_only: bool = False):
+        self.logger = logging.getLogger("opensubtitles-cache")
+        self._cache_dir = cache_dir
+        self.read_only = read_only
+
+        # Per namespace index of the entries: key -> [size, modified time, access time],
+        # and a min-heap of (modified time, key), ordered by their expiration.
+        # They are seeded by a single scan of the namespace dir, and then kept up to date by the operations.
+        self._index_lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, List]] = {}
+        self._expiry_heaps: Dict[str, List[Tuple[float, str]]] = {}
+        self._scan_times: Dict[str, float] = {}
+        self._cleanup_times: Dict[str, float] = {}
+
+    def namespace_path(self, namespace: str) -> str:
+        path = os.path.join(self._cache_dir, namespace)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def entry_path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.namespace_path(namespace), key)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise PermissionError(f"Read-only cache: {self._cache_dir}")
+
+    def _update_index(self, namespace: str, key: str, stat: Optional[os.stat_result]):
+        with self._index_lock:
+            entries = self._entries.get(namespace, None)
+            if entries is None:
+                return
+            if stat is None:
+                entries.pop(key, None)
+                return
+            entry = entries.get(key, None)
+            entries[key] = [stat.st_size, stat.st_mtime, stat.st_atime]
+            if entry is None or entry[1] != stat.st_mtime:
+                heapq.heappush(self._expiry_heaps[namespace], (stat.st_mtime, key))
+
+    def read(self, namespace: str, key: str) -> Optional[CacheEntry]:
+        try:
+            with open(os.path.join(self._cache_dir, namespace, key), 'rb') as f:
+                stat = os.fstat(f.fileno())
+                content = f.read()
+                if not self.read_only and time.time() - stat.st_atime > ACCESS_RESOLUTION_SECONDS:
+                    # Through the open file, so an entry that was just replaced by another process is not modified
+                    os.utime(f.fileno(), ns=(time.time_ns(), stat.st_mtime_ns))
+                    self._update_index(namespace, key, os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None
+        return content, stat.st_mtime
+
+    def write(self, namespace: str, key: str, content: bytes, created: Optional[float] = None):
+        self._check_writable()
+        path = self.entry_path(namespace, key)
+        fd, tmp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                os.fchmod(f.fileno(), ENTRY_FILE_MODE)
+                f.write(content)
+            if created is not None:
+                os.utime(tmp_path, (time.time(), created))
+            # Once renamed, the entry might already be evicted by another process
+            stat = os.stat(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_path)
+            raise
+        self._update_index(namespace, key, stat)
+
+    def delete(self, namespace: str, key: str):
+        self._check_writable()
+        try:
+            os.unlink(self.entry_path(namespace, key))
+        except FileNotFoundError:
+            pass
+        self._update_index(namespace, key, None)
+
+    def keys(self, namespace: str) -> Iterator[str]:
+        path = os.path.join(self._cache_dir, namespace)
+        if os.path.isdir(path):
+            # Skip temporary files of ongoing writes
+            yield from (key for key in os.listdir(path) if not key.startswith('.'))
+
+    def _namespace_index(self, namespace: str) -> Dict[str, List]:
+        """ Must be called while holding the index lock """
+        entries = self._entries.get(namespace, None)
+        if entries is not None and time.time() - self._scan_times[namespace] < RESCAN_INTERVAL_SECONDS:
+            return entries
+
+        entries = {}
+        with os.scandir(self.namespace_path(namespace)) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries[entry.name] = [stat.st_size, stat.st_mtime, stat.st_atime]
+        expiry_heap = [(modified, key) for key, (_, modified, _) in entries.items()]
+        heapq.heapify(expiry_heap)
+        self._entries[namespace] = entries
+        self._expiry_heaps[namespace] = expiry_heap
+        self._scan_times[namespace] = time.time()
+        return entries
+
+    @contextlib.contextmanager
+    def eviction_lock(self) -> ContextManager[bool]:
+        if fcntl is None:
+            yield True
+            return
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+        with open(os.path.join(self._cache_dir, '.eviction.lock'), 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def usage(self, namespace: str) -> List[EntryUsage]:
+        with self._index_lock:
+            return [(key, size, accessed) for key, (size, _, accessed) in self._namespace_index(namespace).items()]
+
+    def _remove_stale_temporary_files(self, namespace: str):
+        """ Delete the temporary files of interrupted writes (at most once per rescan interval) """
+        current_time = time.time()
+        if current_time - self._cleanup_times.get(namespace, 0) < RESCAN_INTERVAL_SECONDS:
+            return
+        self._cleanup_times[namespace] = current_time
+
+        with os.scandir(self.namespace_path(namespace)) as it:
+            for entry in it:
+                if not (entry.name.startswith('.') and entry.name.endswith('.tmp')):
+                    continue
+                # The modified time of an ongoing write may already be set to the entry's (older) creation time,
+                # but its status change time is of its last update
+                with contextlib.suppress(FileNotFoundError):
+                    if entry.stat().st_ctime < current_time - TEMPORARY_FILE_GRACE_SECONDS:
+                        self.logger.info("Delete temporary file: %s", entry.name)
+                        os.unlink(entry.path)
+
+    def evict(self, namespace: str, created_before: float) -> int:
+        self._check_writable()
+        self._remove_stale_temporary_files(namespace)
+        deleted = 0
+        with self._index_lock:
+            entries = self._namespace_index(namespace)
+            expiry_heap = self._expiry_heaps[namespace]
+            while expiry_heap and expiry_heap[0][0] < created_before:
+                modified, key = heapq.heappop(expiry_heap)
+                entry = entries.get(key, None)
+                # A rewritten entry has a newer item in the heap
+                if entry is None or entry[1] > modified:
+                    continue
+                path = self.entry_path(namespace, key)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    del entries[key]
+                    continue
+                if stat.st_mtime >= created_before:
+                    # Rewritten by another process
+                    entries[key] = [stat.st_size, stat.st_mtime, stat.st_atime]
+                    heapq.heappush(expiry_heap, (stat.st_mtime, key))
+                    continue
+                self.logger.info("Delete: %s", key)
+                del entries[key]
+                with contextlib.suppress(FileNotFoundError):
+                    os.unlink(path)
+                    deleted += 1
+        return deleted
+
+
+class SQLiteStorage(CacheStorage):
+    """
+    Stores all the entries in a single SQLite database (in WAL mode), with the blobs inline.
+    Entries are indexed by their key (query hash/subtitle id), by their creation time and by their last access.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " namespace TEXT NOT NULL,"
+        " key TEXT NOT NULL,"
+        " content BLOB NOT NULL,"
+        " size INTEGER NOT NULL,"
+        " created REAL NOT NULL,"
+        " accessed REAL NOT NULL,"
+        " PRIMARY KEY (namespace, key)"
+        ") WITHOUT ROWID",
+        "CREATE INDEX IF NOT EXISTS entries_created ON entries (namespace, created)",
+        "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (namespace, accessed)",
+    )
+
+    def __init__(self, db_path: str):
+        self.logger = logging.getLogger("opensubtitles-cache")
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in self.SCHEMA:
+            self._db.execute(statement)
+
+    def read(self, namespace: str, key: str) -> Optional[CacheEntry]:
+        current_time = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT content, created, accessed FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            if current_time - row[2] > ACCESS_RESOLUTION_SECONDS:
+                self._db.execute(
+                    "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (current_time, namespace, key)
+                )
+        return bytes(row[0]), row[1]
+
+    def write(self, namespace: str, key: str, content: bytes, created: Optional[float] = None):
+        current_time = time.time()
+        if created is None:
+            created = current_time
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (namespace, key, content, size, created, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, content, len(content), created, current_time)
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._db.execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def keys(self, namespace: str) -> Iterator[str]:
+        with self._lock:
+            rows = self._db.execute("SELECT key FROM entries WHERE namespace = ?", (namespace,)).fetchall()
+        for (key,) in rows:
+            yield key
+
+    def usage(self, namespace: str) -> List[EntryUsage]:
+        with self._lock:
+            return self._db.execute(
+                "SELECT key, size, accessed FROM entries WHERE namespace = ?", (namespace,)
+            ).fetchall()
+
+    def evict(self, namespace: str, created_before: float) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM entries WHERE namespace = ? AND created < ?", (namespace, created_before)
+            )
+        return cursor.rowcount
+
+    def evict_lru(self, namespace: str, max_bytes: Optional[int] = None, max_entries: Optional[int] = None) -> int:
+        if max_bytes is None and max_entries is None:
+            return 0
+
+        # Walks the entries by their last access (the entries_accessed index), deleting each entry while the
+        # entries before it did not free enough bytes/entries to be within the budget
+        with self._lock:
+            cursor = self._db.execute(
+                "DELETE FROM entries WHERE namespace = ? AND key IN ("
+                " SELECT key FROM ("
+                "  SELECT key,"
+                "   SUM(size) OVER (ORDER BY accessed ROWS UNBOUNDED PRECEDING) - size AS freed_bytes,"
+                "   ROW_NUMBER() OVER (ORDER BY accessed ROWS UNBOUNDED PRECEDING) - 1 AS freed_entries"
+                "  FROM entries WHERE namespace = ?"
+                " ), ("
+                "  SELECT SUM(size) - COALESCE(?, SUM(size)) AS excess_bytes,"
+                "   COUNT(*) - COALESCE(?, COUNT(*)) AS excess_entries"
+                "  FROM entries WHERE namespace = ?"
+                " )"
+                " WHERE freed_bytes < excess_bytes OR freed_entries < excess_entries"
+                ")",
+                (namespace, namespace, max_bytes, max_entries, namespace)
+            )
+        return cursor.rowcount
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def migrate_storage(source: CacheStorage, target: CacheStorage, namespaces: Tuple[str, ...]) -> int:
+    """
+    Move all the entries of the given namespaces from one storage to another, keeping their creation time.
+    :return: the number of migrated entries
+    """
+    migrated = 0
+    for namespace in namespaces:
+        for key in list(source.keys(namespace)):
+            entry = source.read(namespace, key)
+            if entry is not None:
+                target.write(namespace, key, *entry)
+                migrated += 1
+            source.delete(namespace, key)
+    return migrated
@@ -0,0 +1,37 @@
+"""
+The plugin package imports PyGObject and the Totem plugin typelibs (Peas) when it is imported, while the tests only
+exercise the api modules. When they are not installed, gi.repository is stubbed, so the tests run on a plain
+Python install (the tests that need the real GIO are skipped).
+"""
+import sys
+import types
+from unittest import mock
+
+import pytest
+
+try:
+    import gi
+    gi.require_version("Peas", "1.0")
+    from gi.repository import Gio, GLib, GObject, Peas  # noqa: F401
+    GI_STUBBED = False
+except (ImportError, ValueError):
+    GI_STUBBED = True
+    gi_repository = types.ModuleType("gi.repository")
+    for name in ("Gdk", "Gio", "GLib", "Gtk", "Pango"):
+        setattr(gi_repository, name, mock.MagicMock(name=name))
+    # Base classes of the plugin class
+    gi_repository.GObject = mock.MagicMock(name="GObject", Object=type("Object", (), {}))
+    gi_repository.Peas = types.SimpleNamespace(Activatable=type("Activatable", (), {}))
+    gi_stub = types.ModuleType("gi")
+    gi_stub.repository = gi_repository
+    gi_stub.require_version = lambda namespace, version: None
+    sys.modules.update({"gi": gi_stub, "gi.repository": gi_repository})
+
+
+@pytest.fixture
+def gio():
+    """ :return: the GIO module (the test is skipped when gi.repository is stubbed) """
+    if GI_STUBBED:
+        pytest.skip("PyGObject and the Totem plugin typelibs are not installed")
+    from gi.repository import Gio
+    return Gio
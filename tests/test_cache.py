@@ -0,0 +1,109 @@
+import queue
+from typing import List
+
+import pytest
+
+from opensubtitles.api import OpenSubtitlesApi
+
+ROWS = [
+    {'IDSubtitleFile': str(i), 'IDSubtitle': str(100 + i), 'SubFileName': name, 'SubLanguageID': language,
+     'SubFormat': 'srt', 'SubRating': str(i % 10), 'SubSize': '1000', 'SubHash': f"{i:032x}"}
+    for i, (name, language) in enumerate([
+        ("The.Matrix.1999.1080p.BluRay.x264-GRP.srt", 'eng'),
+        ("The.Matrix.1999.720p.WEB-DL.AMZN.srt", 'heb'),
+        ("The.Matrix.1999.DVDRip.XviD-X.srt", 'eng'),
+        ("The.Matrix.1999.1080p.BluRay.x265-RARBG.srt", 'fre'),
+        ("The.Matrix.1999.720p.BrRip.x264.YIFY.srt", 'heb'),
+    ])
+]
+
+
+class FakeServer:
+    """ Responds with the rows of the queried languages (all of them if none), and records the queried languages """
+
+    def __init__(self):
+        self.searches: List[str] = []
+
+    def LogIn(self, username, password, language, user_agent):
+        return {'status': '200 OK', 'token': 'token'}
+
+    def SearchSubtitles(self, token, queries):
+        languages = queries[0]['sublanguageid']
+        self.searches.append(languages)
+        data = [r for r in ROWS if not languages or r['SubLanguageID'] in languages.split(",")]
+        return {'status': '200 OK', 'data': data or False}
+
+
+def new_api(cache_dir) -> OpenSubtitlesApi:
+    api = OpenSubtitlesApi("test", cache_dir=str(cache_dir))
+    api._server = FakeServer()
+    return api
+
+
+def search(api: OpenSubtitlesApi, languages: List[str]) -> List[str]:
+    """ :return: the ids of the ranked results """
+    query = api.search_subtitles_with_title(languages, movie_title="The Matrix",
+                                            movie_file_path="/movies/The.Matrix.1999.1080p.BluRay.x264-GRP.mkv")
+    if not query.has_results:
+        return []
+    return [r.data['IDSubtitleFile'] for r in query]
+
+
+@pytest.mark.parametrize("cached_languages, languages, fetched_languages", [
+    # Reordered languages
+    (["eng", "heb"], ["heb", "eng"], []),
+    # Partial hit: only the missing language is fetched
+    (["eng"], ["heb", "eng"], ["heb"]),
+    (["eng", "fre"], ["fre", "heb", "eng"], ["heb"]),
+    # A language without results is cached as negative
+    (["ger"], ["ger", "eng"], ["eng"]),
+    (["ger", "eng"], ["eng", "ger"], []),
+    # Without languages, the query is not split by language
+    ([], [], []),
+    ([], ["eng"], ["eng"]),
+    (["eng", "heb", "fre"], [], [""]),
+])
+def test_cached_shards(tmp_path, cached_languages, languages, fetched_languages):
+    api = new_api(tmp_path / "cache")
+    search(api, cached_languages)
+    assert api._server.searches == [",".join(cached_languages)]
+
+    results = search(api, languages)
+    assert api._server.searches[1:] == fetched_languages
+    assert results == search(new_api(tmp_path / "uncached"), languages)
+    # All the languages are cached now
+    assert search(api, languages) == results
+    assert api._server.searches[1:] == fetched_languages
+
+
+def test_negative_shard(tmp_path):
+    api = new_api(tmp_path)
+    assert search(api, ["ger"]) == []
+    assert search(api, ["ger"]) == []
+    assert api._server.searches == ["ger"]
+
+
+def test_all_languages_shard(tmp_path):
+    api = new_api(tmp_path)
+    results = search(api, [])
+    assert sorted(results) == sorted(r['IDSubtitleFile'] for r in ROWS)
+    assert search(api, []) == results
+    assert api._server.searches == [""]
+
+
+def test_stale_refresh_is_ranked(tmp_path, monkeypatch):
+    """ The refreshed query is ranked (and its ranking is cached) before it is passed to the callback """
+    api = new_api(tmp_path)
+    search(api, ["eng", "heb"])
+    monkeypatch.setattr(api._cache, "_is_fresh", lambda namespace, created: False)
+
+    refreshed = queue.Queue()
+
+    def on_refresh(query):
+        refreshed.put((query._results.is_ranked, api._cache._storage.read(api._cache.RANKINGS, query.query_hash)))
+
+    query = api.search_subtitles_with_title(["eng", "heb"], movie_title="The Matrix", on_refresh=on_refresh)
+    assert query.is_stale
+    is_ranked, rankings = refreshed.get(timeout=10)
+    assert is_ranked
+    assert rankings is not None
@@ -0,0 +1,89 @@
+import json
+import os
+import random
+from typing import List
+
+import pytest
+
+from opensubtitles.api.filenameparser import (AUDIO_LABELS, parse_filename_regex, parse_filename_tokens,
+                                              QUALITY_OPTIONS, RELEASE_FORMATS, TV_TERMS, VIDEO_CONTAINERS,
+                                              VIDEO_LABELS)
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "corpus", "filenames.jsonl")
+
+UNICODE_NAMES = [
+    # Case-insensitive regexps match the Kelvin sign (\u212a) to "k", the long s (\u017f) to "s",
+    # and the dotted I (\u0130) to "i"
+    "The.Matrix.1999.4\u212a.UHD.BluRay.x265-GRP.mkv",
+    "Breaking.Bad.\u017f01E05.720p.WEB-DL.AMZN-FLUX.mkv",
+    "Dune.2021.1080p.HDR\u0130p.DDP5.1-GRP.mkv",
+    "Dune.2021.1080p.BLURAY.XV\u0130D-GRP.mkv",
+    # The dotless i (\u0131) matches nothing
+    "Amelie.2001.DVDR\u0131p.XV\u0131D-GRP.avi",
+    "Amélie.2001.1080p.BluRay.x264-GRP.mkv",
+    "千と千尋の神隠し.2001.1080p.BluRay.x264-GRP.mkv",
+    "Shingeki.no.Kyōjin.S04E28.1080p.CR.WEB-DL.AAC2.0.H.264-GRP.mkv",
+]
+EDGE_NAMES = [
+    # Terms that end with a separator, followed by more separators
+    "Show.S01E01.M-ON!.WEB-DL-GRP.mkv",
+    "Show.S01E01.M-ON!!.720p.HDTV-GRP.mkv",
+    "Show.S01E01.M-ON!-GRP.mkv",
+    # The audio quality in the middle of a token
+    "Movie.2020.1080p.WEB-DL.DDP5.1.H.264-GRP.mkv",
+    "Movie.2020.1080p.WEB-DL.AAC5.1-GRP.mkv",
+    "Movie.DDP5.1.AMZN.2020-GRP.mkv",
+    "MovieDD5.1.AMZN-GRP.mkv",
+    "Movie.2020.6CH.x264-GRP.mkv",
+    "Movie.2020.AAC6CH-GRP.mkv",
+    "Movie.AMZN5.1-GRP.mkv",
+    "",
+    ".mkv",
+    "-",
+    "S01E01",
+    "1999",
+]
+
+
+def read_corpus_names() -> List[str]:
+    with open(CORPUS_PATH, encoding="utf8") as f:
+        return [json.loads(line)['name'] for line in f]
+
+
+def fuzz_names(n: int, seed: int) -> List[str]:
+    """ :return: random names, of the parsed terms and of arbitrary chars, joined by random separators """
+    r = random.Random(seed)
+    terms = QUALITY_OPTIONS + RELEASE_FORMATS + TV_TERMS + VIDEO_LABELS + AUDIO_LABELS
+    chars = "abcdefikmnostx0123456789 .-_!()[]\u212a\u017f\u0130\u0131é"
+    names = []
+    for _ in range(n):
+        parts = []
+        for _ in range(r.randint(1, 8)):
+            kind = r.random()
+            if kind < .4:
+                parts.append(r.choice(terms))
+            elif kind < .5:
+                parts.append(r.choice(["1999", "2024", "S01E02", "s12", "5.1", "7.1", "6CH", "2.0"]))
+            else:
+                parts.append("".join(r.choices(chars, k=r.randint(1, 6))))
+        name = "".join(p + r.choice(["", ".", ".", " ", "-", "_", "!", ".-"]) for p in parts)
+        if r.random() < .5:
+            name += "." + r.choice(VIDEO_CONTAINERS)
+        names.append(name)
+    return names
+
+
+@pytest.mark.parametrize("name", UNICODE_NAMES + EDGE_NAMES)
+def test_tokens_parser_edge_cases(name):
+    assert parse_filename_tokens(name) == parse_filename_regex(name)
+
+
+def test_tokens_parser_corpus():
+    mismatches = [name for name in read_corpus_names() if parse_filename_tokens(name) != parse_filename_regex(name)]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_tokens_parser_fuzz(seed):
+    mismatches = [name for name in fuzz_names(500, seed) if parse_filename_tokens(name) != parse_filename_regex(name)]
+    assert mismatches == []
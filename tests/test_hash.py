@@ -0,0 +1,87 @@
+import os
+import struct
+
+import pytest
+
+from opensubtitles.api import hash as movie_hash
+from opensubtitles.api.hash import (block_mask, block_size, hash_file, hash_files, hash_gio_file, min_file_size,
+                                    sum_block)
+
+# Just over two blocks, and sizes that are not a multiple of the word size
+FILE_SIZES = [min_file_size, min_file_size + 1, min_file_size + 7, min_file_size + 8,
+              min_file_size + block_size // 2 + 3, 5 * block_size + 5]
+
+
+@pytest.fixture(params=["numpy", "struct"])
+def sum_path(request, monkeypatch):
+    if request.param == "numpy":
+        if movie_hash.numpy is None:
+            pytest.skip("NumPy is not installed")
+    else:
+        monkeypatch.setattr(movie_hash, "numpy", None)
+    return request.param
+
+
+def reference_hash(file_path) -> str:
+    """ The per-word implementation (see https://trac.opensubtitles.org/projects/opensubtitles/wiki/HashSourceCodes) """
+    file_size = os.path.getsize(file_path)
+    file_hash = file_size
+    with open(file_path, "rb") as f:
+        for offset in [0, max(0, file_size - block_size)]:
+            f.seek(offset, os.SEEK_SET)
+            for _ in range(block_size // 8):
+                (word,) = struct.unpack('<q', f.read(8))
+                file_hash = (file_hash + word) & block_mask
+    return "%016x" % file_hash
+
+
+def write_file(path, size: int) -> str:
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+
+def test_sum_block(sum_path):
+    for buf in [bytes(block_size), b"\xff" * block_size, os.urandom(block_size)]:
+        expected = 0
+        for (word,) in struct.iter_unpack('<q', buf):
+            expected = (expected + word) & block_mask
+        assert sum_block(buf) == expected
+
+
+@pytest.mark.parametrize("file_size", FILE_SIZES)
+def test_hash_file(tmp_path, sum_path, file_size):
+    file_path = write_file(tmp_path / "movie.mkv", file_size)
+    assert hash_file(file_path) == (reference_hash(file_path), file_size)
+
+
+def test_hash_file_without_pread(tmp_path, monkeypatch):
+    file_path = write_file(tmp_path / "movie.mkv", min_file_size + 3)
+    monkeypatch.delattr(os, "pread")
+    assert hash_file(file_path) == (reference_hash(file_path), min_file_size + 3)
+
+
+def test_hash_gio_file(tmp_path, gio):
+    file_path = write_file(tmp_path / "movie.mkv", min_file_size + 5)
+    assert hash_gio_file(gio.File.new_for_path(file_path)) == hash_file(file_path)
+
+
+def test_hash_files_errors(tmp_path):
+    small_path = write_file(tmp_path / "small.mkv", min_file_size - 1)
+    missing_path = str(tmp_path / "missing.mkv")
+    movie_path = write_file(tmp_path / "movie.mkv", min_file_size)
+
+    results = {result.path: result for result in hash_files([small_path, missing_path, movie_path], max_workers=2)}
+    assert len(results) == 3
+
+    small = results[small_path]
+    assert small.hash is None and small.size is None
+    assert "larger than two blocks" in str(small.error)
+
+    missing = results[missing_path]
+    assert missing.hash is None and missing.size is None
+    assert isinstance(missing.error, FileNotFoundError)
+
+    movie = results[movie_path]
+    assert movie.error is None
+    assert movie.size == min_file_size and len(movie.hash) == 16
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+from opensubtitles.api import storage
+from opensubtitles.api.storage import CacheStorage, FileSystemStorage, SQLiteStorage
+
+
+def test_cache_storage_is_abstract():
+    with pytest.raises(TypeError):
+        CacheStorage()
+
+
+def fill_sqlite(db_path: str, seed: int) -> SQLiteStorage:
+    """ :return: a storage with entries of random sizes and (distinct) access times, in two namespaces """
+    r = random.Random(seed)
+    storage = SQLiteStorage(db_path)
+    for namespace in "queries", "subtitles":
+        for i in range(50):
+            storage.write(namespace, f"{i:04x}", r.randbytes(r.randint(1, 1000)))
+        for i, accessed in enumerate(r.sample(range(10 ** 6), 50)):
+            storage._db.execute("UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?",
+                                (accessed, namespace, f"{i:04x}"))
+    return storage
+
+
+@pytest.mark.parametrize("max_bytes, max_entries", [
+    (None, None), (None, 50), (None, 49), (None, 10), (None, 0),
+    (10 ** 6, None), (20000, None), (5000, None), (0, None),
+    (20000, 10), (5000, 40), (10 ** 6, 0),
+])
+def test_sqlite_evict_lru(tmp_path, max_bytes, max_entries):
+    """ The SQL eviction deletes the same entries as the default implementation """
+    sql = fill_sqlite(str(tmp_path / "sql.db"), seed=1)
+    reference = fill_sqlite(str(tmp_path / "reference.db"), seed=1)
+
+    deleted = sql.evict_lru("queries", max_bytes, max_entries)
+    assert deleted == CacheStorage.evict_lru(reference, "queries", max_bytes, max_entries)
+    for namespace in "queries", "subtitles":
+        assert sorted(sql.keys(namespace)) == sorted(reference.keys(namespace))
+
+    usage = sql.usage("queries")
+    assert max_bytes is None or sum(size for _, size, _ in usage) <= max_bytes
+    assert max_entries is None or len(usage) <= max_entries
+    assert len(list(sql.keys("subtitles"))) == 50
+
+
+def test_filesystem_evict_removes_stale_temporary_files(tmp_path, monkeypatch):
+    fs = FileSystemStorage(str(tmp_path))
+    fs.write("queries", "entry", b"content")
+    orphan = tmp_path / "queries" / ".entry.orphan.tmp"
+    orphan.write_bytes(b"partial")
+
+    # Within the grace period, the temporary file may be of an ongoing write
+    assert fs.evict("queries", 0) == 0
+    assert orphan.exists()
+
+    monkeypatch.setattr(storage, "TEMPORARY_FILE_GRACE_SECONDS", -1)
+    monkeypatch.setattr(storage, "RESCAN_INTERVAL_SECONDS", 0)
+    assert fs.evict("queries", 0) == 0
+    assert not orphan.exists()
+    assert fs.read("queries", "entry")[0] == b"content"